@@ -0,0 +1,198 @@
+"""Synthetic mod library for benchmarks: a resource folder of loose folders, flat zips,
+zips holding another zip and rars, and a game data folder with some of the mods installed.
+The same arguments and seed always build the same files.
+
+    python bench/generate.py OUT [--mods N] [--installed N] [--sizes T,G,S] ...
+"""
+import argparse
+from dataclasses import dataclass
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from h2mm.model import H2MMCfg
+
+
+@dataclass
+class LibrarySpec:
+    mods: int = 1000
+    # share of the mods in each kind of source, the rest are loose folders
+    flat_zips: float = 0.3
+    nested_zips: float = 0.2
+    rars: float = 0.1
+    # mods per flat zip, one folder each
+    per_zip: int = 2
+    # bytes of the target, .gpu_resources and .stream of each mod
+    sizes: tuple = (4096, 4096, 16384)
+    # share of the mods that have a .gpu_resources and a .stream
+    gpu_resources: float = 0.8
+    stream: float = 0.6
+    manifests: float = 0.5
+    installed: int = 50
+    seed: int = 0
+
+
+class _Mods:
+    """Yields the files of one mod after another, deterministically."""
+
+    def __init__(self, spec: LibrarySpec):
+        self.spec = spec
+        self.rnd = random.Random(spec.seed)
+        self.count = 0
+
+    def next(self):
+        spec = self.spec
+        self.count += 1
+        target = f"{self.rnd.getrandbits(64):016x}.patch_0"
+        files = {target: self.rnd.randbytes(spec.sizes[0])}
+        if self.rnd.random() < spec.gpu_resources:
+            files[target + ".gpu_resources"] = self.rnd.randbytes(spec.sizes[1])
+        if self.rnd.random() < spec.stream:
+            files[target + ".stream"] = self.rnd.randbytes(spec.sizes[2])
+        if self.rnd.random() < spec.manifests:
+            manifest = {"name": f"Mod {self.count}", "description": "Synthetic mod"}
+            files["manifest.json"] = json.dumps(manifest).encode()
+        return files
+
+
+def _write_folder(path: str, files: dict):
+    os.makedirs(path, exist_ok=True)
+    for name, data in files.items():
+        with open(os.path.join(path, name), "wb") as f:
+            f.write(data)
+
+
+def _zip_bytes(folders: dict[str, dict]):
+    with tempfile.SpooledTemporaryFile() as spool:
+        with zipfile.ZipFile(spool, "w", zipfile.ZIP_STORED) as z:
+            for folder, files in folders.items():
+                for name, data in files.items():
+                    z.writestr(folder + name, data)
+        spool.seek(0)
+        return spool.read()
+
+
+def generate_library(root: str, spec: LibrarySpec):
+    """Build root/res and root/game/data, and a config at root/cfg/config.toml
+    with no resource folder yet. Returns (config path, resource folder, installed files)."""
+    shutil.rmtree(root, ignore_errors=True)
+    res = os.path.join(root, "res")
+    data = os.path.join(root, "game", "data")
+    os.makedirs(res)
+    os.makedirs(data)
+    with open(os.path.join(data, "9ba626afa44a3aa3"), "wb") as f:
+        f.write(b"base archive")
+
+    rar = shutil.which("rar")
+    if spec.rars and rar is None:
+        print("rar not found, rar mods are generated as loose folders", file=sys.stderr)
+
+    mods = _Mods(spec)
+    counts = {
+        "flat": int(spec.mods * spec.flat_zips),
+        "nested": int(spec.mods * spec.nested_zips),
+        "rar": int(spec.mods * spec.rars) if rar else 0,
+    }
+    sources = []
+    made = 0
+
+    for i in range(0, counts["flat"], spec.per_zip):
+        folders = {}
+        for j in range(min(spec.per_zip, counts["flat"] - i)):
+            folders[f"variant_{j}/"] = mods.next()
+        path = os.path.join(res, "zips", f"author_{i % 50}", f"flat_{i}.zip")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(_zip_bytes(folders))
+        sources.append((path, folders))
+        made += len(folders)
+
+    # each nested zip holds one mod and an inner zip with another
+    for i in range(0, counts["nested"], 2):
+        outer = mods.next()
+        folders = {"": outer}
+        if i + 1 < counts["nested"]:
+            inner = mods.next()
+            folders[f"inner_{i}.zip!/"] = inner
+            outer = {**outer, f"inner_{i}.zip": _zip_bytes({"": inner})}
+        path = os.path.join(res, "nested", f"nested_{i}.zip")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(_zip_bytes({"": outer}))
+        sources.append((path, folders))
+        made += len(folders)
+
+    for i in range(counts["rar"]):
+        files = mods.next()
+        with tempfile.TemporaryDirectory() as tmp:
+            _write_folder(tmp, files)
+            path = os.path.join(res, "rars", f"mod_{i}.rar")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            subprocess.run(
+                [rar, "a", "-ep1", "-idq", path, *[os.path.join(tmp, name) for name in files]],
+                check=True,
+            )
+        sources.append((path, {"": files}))
+        made += 1
+
+    for i in range(spec.mods - made):
+        files = mods.next()
+        path = os.path.join(res, "loose", f"author_{i % 50}", f"mod_{i}")
+        _write_folder(path, files)
+        sources.append((path, {"": files}))
+
+    # install an even spread of the library
+    installed = []
+    step = max(1, len(sources) // spec.installed) if spec.installed else 0
+    for path, folders in sources[::step][: spec.installed] if step else []:
+        for name, content in next(iter(folders.values())).items():
+            if name == "manifest.json" or name.endswith(".zip"):
+                continue
+            with open(os.path.join(data, name), "wb") as f:
+                f.write(content)
+        installed.append(path)
+
+    cfg_path = os.path.join(root, "cfg", "config.toml")
+    os.makedirs(os.path.dirname(cfg_path))
+    H2MMCfg.create(os.path.join(root, "game"), [], cfgPath=cfg_path)
+    return cfg_path, res, installed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("out")
+    parser.add_argument("--mods", type=int, default=LibrarySpec.mods)
+    parser.add_argument("--flat-zips", type=float, default=LibrarySpec.flat_zips)
+    parser.add_argument("--nested-zips", type=float, default=LibrarySpec.nested_zips)
+    parser.add_argument("--rars", type=float, default=LibrarySpec.rars)
+    parser.add_argument("--sizes", default=",".join(map(str, LibrarySpec.sizes)))
+    parser.add_argument("--gpu-resources", type=float, default=LibrarySpec.gpu_resources)
+    parser.add_argument("--stream", type=float, default=LibrarySpec.stream)
+    parser.add_argument("--installed", type=int, default=LibrarySpec.installed)
+    parser.add_argument("--seed", type=int, default=LibrarySpec.seed)
+    args = parser.parse_args()
+
+    spec = LibrarySpec(
+        mods=args.mods,
+        flat_zips=args.flat_zips,
+        nested_zips=args.nested_zips,
+        rars=args.rars,
+        sizes=tuple(int(size) for size in args.sizes.split(",")),
+        gpu_resources=args.gpu_resources,
+        stream=args.stream,
+        installed=args.installed,
+        seed=args.seed,
+    )
+    cfg_path, res, installed = generate_library(args.out, spec)
+    print(f"{spec.mods} mods in {res}, {len(installed)} installed, config at {cfg_path}")
+
+
+if __name__ == "__main__":
+    main()
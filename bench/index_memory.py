@@ -0,0 +1,77 @@
+"""Memory and load time of mod_res_index and manifest_index, as plain dicts of
+H2PathRef and manifest dicts versus the interned columnar tables.
+
+    python bench/index_memory.py [refs]
+"""
+from hashlib import sha256
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from h2mm.index import H2ManifestTable, H2RefTable
+from h2mm.model import H2PathRef
+
+GROUPS = 4
+SUBPATHS = ("A/", "B/")
+
+
+def ref_rows(refs: int):
+    """Rows as the database cursor yields them: fresh strings for every column."""
+    for i in range(refs):
+        archive = i // len(SUBPATHS)
+        yield (
+            sha256(str(archive * len(SUBPATHS) + i % 2).encode()).hexdigest(),
+            "".join(["/home/user/Games/Helldivers 2/mods/library_", str(i % GROUPS)]),
+            f"authors/author_{archive % 500}/mod_{archive}.zip",
+            "".join(SUBPATHS[i % 2]),
+        )
+
+
+def manifest_rows(refs: int):
+    for i in range(0, refs, 2):
+        manifest = {"name": f"Mod {i // 2}", "description": "A mod " * 8}
+        yield sha256(str(i).encode()).hexdigest(), json.dumps(manifest, separators=(",", ":"))
+
+
+def load_dicts(rows, manifests):
+    mod_res_index = {}
+    for hash, group, path, subpath in rows:
+        mod_res_index.setdefault(hash, []).append(
+            H2PathRef(resourceGroup=group, path=path, subpath=subpath)
+        )
+    manifest_index = {hash: json.loads(data) for hash, data in manifests}
+    return mod_res_index, manifest_index
+
+
+def load_tables(rows, manifests):
+    return H2RefTable.from_rows(rows), H2ManifestTable(manifests)
+
+
+def measure(load, refs: int):
+    tracemalloc.start()
+    start = time.perf_counter()
+    index = load(ref_rows(refs), manifest_rows(refs))
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del index
+    return current, elapsed
+
+
+def main():
+    refs = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    print(f"{refs} refs in {GROUPS} resource folders")
+    results = {}
+    for name, load in (("dicts", load_dicts), ("tables", load_tables)):
+        results[name] = measure(load, refs)
+        size, elapsed = results[name]
+        print(f"{name:>8}: {size / 2**20:8.1f} MiB  {elapsed * 1000:8.1f} ms")
+    print(f"reduction: {1 - results['tables'][0] / results['dicts'][0]:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""Scan and index benchmarks on generated libraries, written as json for comparison.
+
+    python bench/suite.py [--sizes 100,1000,10000] [--out results.json] [--baseline old.json]
+    python bench/suite.py --compare old.json new.json
+
+Each size gets its own library from generate.py under --workdir. Timings are the median
+and minimum of --repeat runs, except for the first scan which can only run once.
+With a baseline, benchmarks whose median got slower by more than --threshold are
+reported and the exit status is 1.
+"""
+import argparse
+from datetime import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from generate import LibrarySpec, generate_library
+from h2mm.db import H2IndexDB
+from h2mm.index import H2ManifestTable, H2RefTable
+from h2mm.mgr import H2MM
+
+# run in a fresh interpreter, so imports, the database and the fingerprint cache start cold
+COLD_LOAD = """
+import sys, time
+start = time.perf_counter()
+from h2mm.mgr import H2MM
+h2mm = H2MM.load(sys.argv[1])
+h2mm.mod_res_index
+h2mm.mod_install_index
+print(time.perf_counter() - start)
+"""
+
+
+def timed(func, repeat: int = 1):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return {"median": statistics.median(runs), "min": min(runs), "runs": repeat}
+
+
+def touch_units(res: str, share: float):
+    """Bump the mtime of a share of the loose mod folders, so a rescan rehashes them."""
+    folders = sorted(
+        dirpath for dirpath, dirnames, filenames in os.walk(res) if filenames and not dirnames
+    )
+    step = max(1, int(1 / share)) if share else 0
+    for folder in folders[::step] if step else []:
+        for name in os.listdir(folder):
+            st = os.stat(os.path.join(folder, name))
+            os.utime(os.path.join(folder, name), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def index_save(h2mm: H2MM, path: str):
+    """Write every index of h2mm to a new database, as a full save would."""
+    if os.path.exists(path):
+        os.remove(path)
+    db = H2IndexDB(path)
+    for hash, pathrefs in h2mm.mod_res_index.items():
+        for pathref in pathrefs:
+            db.add_ref(hash, pathref)
+    for hash in h2mm.manifest_index:
+        db.set_manifest(hash, h2mm.manifest_index.manifest(hash))
+    for hash, part in h2mm.part_index.items():
+        db.set_part(hash, part)
+    for hash, file in h2mm.mod_install_index.items():
+        db.set_install(hash, file)
+    for group, units in h2mm.tree_index.items():
+        db.set_units(group, units)
+    db.close()
+
+
+def index_load(path: str):
+    db = H2IndexDB(path)
+    H2RefTable.from_rows(db.load_refs())
+    H2ManifestTable(db.load_manifests())
+    db.load_parts()
+    db.load_installs()
+    db.load_units()
+    db.close()
+
+
+def run_size(workdir: str, mods: int, repeat: int, spec_args: dict):
+    spec = LibrarySpec(mods=mods, installed=max(1, mods // 20), **spec_args)
+    root = os.path.join(workdir, str(mods))
+    cfg_path, res, _ = generate_library(root, spec)
+    results = {}
+
+    h2mm = H2MM.load(cfg_path)
+    results["scan_full"] = timed(lambda: h2mm.add_resource_folder(res))
+    results["reparse_unchanged"] = timed(lambda: h2mm.reparse_resource_folder(res), repeat)
+    touch_units(res, 0.01)
+    results["reparse_touched_1pct"] = timed(lambda: h2mm.reparse_resource_folder(res))
+    results["reparse_installed_mods"] = timed(h2mm.reparse_installed_mods, repeat)
+    results["list_installed_mods"] = timed(h2mm.list_installed_mods, repeat)
+
+    db_path = os.path.join(root, "bench.db")
+    results["index_save"] = timed(lambda: index_save(h2mm, db_path), repeat)
+    results["index_load"] = timed(lambda: index_load(db_path), repeat)
+    h2mm.db.close()
+
+    def load_warm():
+        warm = H2MM.load(cfg_path)
+        warm.mod_res_index
+        warm.mod_install_index
+        warm.db.close()
+
+    results["load_warm"] = timed(load_warm, repeat)
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.join(os.path.dirname(__file__), "..", "src")
+    runs = [
+        float(
+            subprocess.run(
+                [sys.executable, "-c", COLD_LOAD, cfg_path],
+                env=env,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+        )
+        for _ in range(repeat)
+    ]
+    results["load_cold"] = {"median": statistics.median(runs), "min": min(runs), "runs": repeat}
+    return results
+
+
+def compare(baseline: dict, current: dict, threshold: float):
+    """Print the change of every benchmark in both runs, returns the regressions."""
+    regressions = []
+    print(f"{'size':>7} {'benchmark':<24} {'baseline':>10} {'current':>10} {'change':>8}")
+    for size, results in current["results"].items():
+        for name, result in results.items():
+            base = baseline["results"].get(size, {}).get(name)
+            if base is None:
+                continue
+            change = result["median"] / base["median"] - 1 if base["median"] else 0.0
+            flag = ""
+            if change > threshold:
+                flag = "  regression"
+                regressions.append((size, name, change))
+            print(
+                f"{size:>7} {name:<24} {base['median'] * 1000:8.1f}ms "
+                f"{result['median'] * 1000:8.1f}ms {change:+7.1%}{flag}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workdir", default=None)
+    parser.add_argument("--out", default=None)
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--threshold", type=float, default=0.10)
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"))
+    parser.add_argument("--rars", type=float, default=LibrarySpec.rars)
+    parser.add_argument("--sizes-bytes", default=",".join(map(str, LibrarySpec.sizes)))
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        with open(args.compare[1], "r", encoding="utf-8") as f:
+            current = json.load(f)
+        sys.exit(1 if compare(baseline, current, args.threshold) else 0)
+
+    spec_args = {
+        "rars": args.rars,
+        "sizes": tuple(int(size) for size in args.sizes_bytes.split(",")),
+    }
+    current = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "spec": spec_args,
+        },
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        for mods in (int(size) for size in args.sizes.split(",")):
+            current["results"][str(mods)] = results = run_size(
+                workdir, mods, args.repeat, spec_args
+            )
+            for name, result in results.items():
+                print(f"{mods:>7} {name:<24} {result['median'] * 1000:8.1f}ms")
+
+    out = args.out or f"bench-{datetime.now():%Y%m%d-%H%M%S}.json"
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(current, f, indent=2)
+    print(f"Results written to {out}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(baseline, current, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,45 @@
+from dataclasses import asdict
+import os
+import typing
 import click
-from tabulate import tabulate
-from h2mm.mgr import H2MM
 from h2mm.model import H2MMCfg
-from h2mm.utils import wrap_text
+
+if typing.TYPE_CHECKING:
+    from h2mm.mgr import H2MM
+
+# commands import the manager and their dependencies on demand to keep startup fast
+
+def from_daemon(ctx, command, **args):
+    """Ask a running daemon, returns (True, result) or (False, None) if there is none."""
+    from h2mm.daemon import request
+
+    cfg_dir = os.path.dirname(os.path.abspath(ctx.obj.cfg_path))
+    try:
+        return True, request(cfg_dir, command, **args)
+    except OSError:
+        return False, None
 
 @click.group(invoke_without_command=True)
+@click.option("--profile", is_flag=True, help="Print where the time went once the command ends")
+@click.option(
+    "--trace", "trace_path", default=None,
+    help="Also write the timings as a Chrome trace to this file",
+)
 @click.pass_context
-def cli(ctx):
+def cli(ctx, profile, trace_path):
+    if profile or trace_path:
+        from h2mm.perf import profiler
+
+        profiler.enable(trace=trace_path is not None)
+
+        def report():
+            if profile:
+                click.echo(profiler.report(), err=True)
+            if trace_path:
+                profiler.write_chrome_trace(trace_path)
+
+        ctx.call_on_close(report)
+
     if not H2MMCfg.exists():
         click.echo("H2MM is not initialized. Initializing...")
         try:
@@ -20,6 +53,9 @@ def cli(ctx):
         except Exception:  
             game_path = click.prompt("Enter the path to the game directory", type=str)
         H2MMCfg.create(game_path)
+
+    from h2mm.mgr import H2MM
+
     ctx.obj = H2MM.load()
     ctx.ensure_object(H2MM)
 
@@ -30,8 +66,13 @@ def list_group():
 @list_group.command()
 @click.pass_context
 def installed(ctx):
+    from tabulate import tabulate
+    from h2mm.utils import wrap_text
+
     h2mm : H2MM = ctx.obj
-    table = h2mm.list_installed_mods()
+    served, table = from_daemon(ctx, "list_installed")
+    if not served:
+        table = h2mm.list_installed_mods()
     # Clean up the data and wrap long text
     if isinstance(table, list) and table and isinstance(table[0], dict):
         cleaned_table = []
@@ -59,6 +100,305 @@ def installed(ctx):
         disable_numparse=True
     ))
 
+def hashing_bar(label, length):
+    """A progress bar of bytes hashed, showing the throughput."""
+    import time
+
+    start = time.monotonic()
+
+    def throughput(_):
+        elapsed = time.monotonic() - start
+        return f"{bar.pos / 2**20 / elapsed:.1f} MB/s" if elapsed > 0 else ""
+
+    bar = click.progressbar(
+        length=length,
+        label=label,
+        show_eta=True,
+        show_percent=True,
+        item_show_func=throughput,
+    )
+    return bar
+
+def scan_with_progress(h2mm, path, jobs, fast):
+    """Run a scan behind a progress bar of the bytes hashed, returns its report."""
+    events = h2mm.scan_resource_folder(path, jobs=jobs, fast=fast)
+    warnings = []
+    bar = None
+
+    try:
+        while True:
+            try:
+                event = next(events)
+            except StopIteration as stop:
+                return stop.value
+            if event.kind == "hashing" and bar is None:
+                bar = hashing_bar(f"Hashing {path}", event.bytes_total).__enter__()
+            if bar is not None and event.kind == "scanned":
+                bar.update(event.bytes_done - bar.pos)
+            if event.kind == "error":
+                warnings.append(event.message)
+    finally:
+        if bar is not None:
+            bar.__exit__(None, None, None)
+        for warning in warnings:
+            click.echo(f"Warning: {warning}", err=True)
+
+def reparse_with_progress(h2mm, paths, per_device, fast, jobs):
+    """Run reparse_resource_folders behind one progress bar of the bytes hashed in every
+    folder, whose length grows as the folders are walked. Returns their reports."""
+    done = {}
+    warnings = []
+
+    try:
+        with hashing_bar(f"Hashing {len(paths)} folders", 0) as bar:
+            def progress(path, event):
+                if event.kind == "discovered":
+                    bar.length += event.bytes_total
+                elif event.kind == "scanned":
+                    bar.update(event.bytes_done - done.get(path, 0))
+                    done[path] = event.bytes_done
+                elif event.kind == "error":
+                    warnings.append(event.message)
+
+            return h2mm.reparse_resource_folders(
+                paths, per_device=per_device, fast=fast, jobs=jobs, progress=progress
+            )
+    finally:
+        for warning in warnings:
+            click.echo(f"Warning: {warning}", err=True)
+
+@cli.command()
+@click.argument("path", required=False)
+@click.option(
+    "--jobs", "-j", default=1, show_default=True,
+    help="Number of hashing processes, 0 for one per CPU",
+)
+@click.option(
+    "--fast/--full", default=None,
+    help="Identify zips by their central directory instead of hashing them",
+)
+@click.option(
+    "--per-device", default=None, type=int,
+    help="Units hashed at once per disk when scanning every resource folder",
+)
+@click.pass_context
+def reparse(ctx, path, jobs, fast, per_device):
+    h2mm : H2MM = ctx.obj
+    paths = [path] if path else [resource["path"] for resource in h2mm.cfg.resources]
+    reports = {}
+    if len(paths) > 1 and not from_daemon(ctx, "ping")[0]:
+        # several folders, possibly on several disks, are scanned concurrently
+        reports = {
+            path: asdict(report)
+            for path, report in reparse_with_progress(
+                h2mm, paths, per_device, fast, jobs
+            ).items()
+        }
+    for path in paths:
+        report = reports.get(os.path.abspath(path))
+        if report is None:
+            served, report = from_daemon(
+                ctx, "reparse", path=os.path.abspath(path), jobs=jobs, fast=fast
+            )
+            if not served:
+                report = asdict(scan_with_progress(h2mm, path, jobs, fast))
+        click.echo(
+            f"Reparsed {path}: {report['added']} added, {report['changed']} changed, "
+            f"{report['removed']} removed, {report['unchanged']} unchanged "
+            f"(walked {report['walk']['folders']} folders in {report['walk']['seconds']:.2f}s, "
+            f"{report['walk']['stat_calls']} stat calls)"
+        )
+
+@cli.command()
+@click.argument("hash")
+@click.pass_context
+def lookup(ctx, hash):
+    import json
+
+    h2mm : H2MM = ctx.obj
+    served, result = from_daemon(ctx, "lookup", hash=hash)
+    if not served:
+        result = h2mm.lookup(hash)
+    click.echo(json.dumps(result, indent=2, ensure_ascii=False))
+
+@cli.command()
+@click.argument("path")
+@click.pass_context
+def which(ctx, path):
+    h2mm : H2MM = ctx.obj
+    found = h2mm.which(path)
+    if not found:
+        click.echo(f"No indexed mod at {path}")
+    for hash, pathref in found:
+        click.echo(f"{hash}  {pathref.path}/{pathref.subpath}".rstrip("/"))
+
+@cli.command()
+@click.argument("mod")
+@click.pass_context
+def install(ctx, mod):
+    h2mm : H2MM = ctx.obj
+    served, result = from_daemon(ctx, "install", mod=mod)
+    if not served:
+        installed, methods = h2mm.install_mod(mod)
+        result = {"installed_file": installed, "methods": methods}
+    click.echo(f"Installed {mod} as {result['installed_file']}")
+    for part, method in result["methods"].items():
+        click.echo(f"  {part}: {method}")
+
+@cli.command()
+@click.argument("mods", nargs=-1, required=True)
+@click.option(
+    "--with-installed", is_flag=True,
+    help="Plan the installed mods together with the given ones",
+)
+@click.pass_context
+def plan(ctx, mods, with_installed):
+    from tabulate import tabulate
+
+    h2mm : H2MM = ctx.obj
+    install_plan = h2mm.plan_install(mods, with_installed=with_installed)
+    click.echo(tabulate(
+        [
+            {
+                "patch": patch.file,
+                "name": patch.name,
+                "hash": patch.hash[:12],
+                "priority": install_plan.mods[patch.hash].patch_num_priority,
+                "installed_as": h2mm.mod_install_index.get(patch.hash, ""),
+            }
+            for patch in install_plan.patches()
+        ],
+        headers="keys",
+        tablefmt="simple",
+        disable_numparse=True,
+    ))
+    conflicts = install_plan.conflicts()
+    if conflicts:
+        click.echo(f"\n{len(conflicts)} conflicting assets:")
+    for conflict in conflicts:
+        names = " < ".join(install_plan.mods[hash].name for hash in conflict.hashes)
+        status = ""
+        if not conflict.resolved:
+            targets = {install_plan.targets[hash] for hash in conflict.hashes}
+            status = "  (unresolved, " + (
+                "set patchNumPriority)" if len(targets) == 1 else "patches different archives)"
+            )
+        click.echo(f"  {conflict.asset}: {names}{status}")
+
+@cli.group()
+def profile():
+    pass
+
+@profile.command(name="save")
+@click.argument("name")
+@click.pass_context
+def profile_save(ctx, name):
+    h2mm : H2MM = ctx.obj
+    click.echo(f"Saved {h2mm.save_profile(name)} installed mods as {name}")
+
+@profile.command(name="apply")
+@click.argument("name")
+@click.pass_context
+def profile_apply(ctx, name):
+    h2mm : H2MM = ctx.obj
+    click.echo(f"Applied {name}, {h2mm.apply_profile(name)} mods installed")
+
+@profile.command(name="rollback")
+@click.pass_context
+def profile_rollback(ctx):
+    h2mm : H2MM = ctx.obj
+    click.echo(f"Rolled back, {h2mm.rollback_profile()} mods installed")
+
+@profile.command(name="list")
+@click.pass_context
+def profile_list(ctx):
+    h2mm : H2MM = ctx.obj
+    for name in h2mm.profiles.names():
+        click.echo(name)
+
+@cli.group()
+def store():
+    pass
+
+@store.command(name="add")
+@click.argument("path")
+@click.pass_context
+def store_add(ctx, path):
+    h2mm : H2MM = ctx.obj
+    added = h2mm.add_resource(path)
+    click.echo(f"Stored {len(added)} new mods from {path}")
+    for hash in added:
+        click.echo(f"  {hash}")
+
+@store.command(name="rm")
+@click.argument("mod")
+@click.pass_context
+def store_rm(ctx, mod):
+    h2mm : H2MM = ctx.obj
+    click.echo(f"Removed {h2mm.remove_resource(mod)} from the store")
+
+@store.command(name="gc")
+@click.pass_context
+def store_gc(ctx):
+    h2mm : H2MM = ctx.obj
+    removed, reclaimed = h2mm.store.gc()
+    click.echo(f"Removed {removed} unreferenced files, reclaimed {reclaimed} bytes")
+
+@cli.group()
+def index():
+    pass
+
+@index.command(name="export")
+@click.argument("out")
+@click.option(
+    "--root", default=None,
+    help=(
+        "Folder the resource folders are stored relative to, by default their common path,"
+        " which is the folder itself when there is only one"
+    ),
+)
+@click.pass_context
+def index_export(ctx, out, root):
+    h2mm : H2MM = ctx.obj
+    count = h2mm.export_index(out, root=root)
+    click.echo(f"Exported {count} mods to {out}")
+
+@index.command(name="import")
+@click.argument("snapshot")
+@click.argument("root")
+@click.option(
+    "--fast/--full", default=None,
+    help="Identify changed zips by their central directory instead of hashing them",
+)
+@click.pass_context
+def index_import(ctx, snapshot, root, fast):
+    h2mm : H2MM = ctx.obj
+    for path, report in h2mm.import_index(snapshot, root, fast=fast).items():
+        click.echo(
+            f"Imported {path}: {report.unchanged} trusted, "
+            f"{report.added + report.changed} rehashed, {report.removed} removed"
+        )
+
+@cli.command()
+@click.option(
+    "--poll-interval", default=5.0, show_default=True,
+    help="Seconds between scans where inotify is not available",
+)
+@click.pass_context
+def daemon(ctx, poll_interval):
+    import logging
+    from h2mm.daemon import H2MMDaemon
+
+    logging.basicConfig(level=logging.INFO)
+    click.echo("Serving h2mm indexes, press Ctrl+C to stop")
+    try:
+        H2MMDaemon(ctx.obj, poll_interval).serve_forever()
+    except KeyboardInterrupt:
+        pass
+
 if __name__ == "__main__":
+    import multiprocessing
 
+    # hashing workers of a frozen executable start through here
+    multiprocessing.freeze_support()
     cli()
@@ -0,0 +1,350 @@
+from dataclasses import dataclass
+import shutil
+import tempfile
+import typing
+from h2mm.perf import profiler
+
+# archive members read ahead of their turn are kept in memory up to this size
+SPOOL_MAX_SIZE = 64 * 1024 * 1024
+
+
+class ArchiveError(Exception):
+    """An archive that cannot be read with the backends available here."""
+
+
+@dataclass(slots=True)
+class ArchiveMember:
+    filename: str
+    file_size: int
+    # CRC32 of the content, None where the format does not store one
+    crc: typing.Optional[int] = None
+
+
+class ArchiveBackend:
+    """A readable archive format.
+    Backends list their files with members(), in archive order and without folders,
+    and open one member at a time with open(). stream() reads several members in a single
+    sequential pass; solid backends can only be read efficiently that way, since opening
+    a member decompresses everything stored before it."""
+
+    kind = ""
+    exts: typing.Tuple[str, ...] = ()
+    solid = False
+
+    def __init__(self, path: str, fileobj: typing.Optional[typing.IO[bytes]] = None):
+        self.path = path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        pass
+
+    @classmethod
+    def errors(cls) -> typing.Tuple[typing.Type[Exception], ...]:
+        """The exceptions raised by the underlying library for an unreadable archive."""
+        return ()
+
+    @classmethod
+    def password_errors(cls) -> typing.Tuple[typing.Type[Exception], ...]:
+        return ()
+
+    def members(self) -> typing.List[ArchiveMember]:
+        raise NotImplementedError
+
+    def namelist(self) -> typing.List[str]:
+        return [member.filename for member in self.members()]
+
+    def open(self, name: str) -> typing.IO[bytes]:
+        raise NotImplementedError
+
+    def stream(self, names: typing.Iterable[str]):
+        """Yield (name, file) for each of names, in the order given.
+        Each file is only readable until the next one is yielded."""
+        for name in names:
+            with self.open(name) as f:
+                yield name, f
+
+
+BACKENDS: dict[str, typing.Type[ArchiveBackend]] = {}
+_exts: typing.Tuple[str, ...] = ()
+
+
+def register_backend(backend: typing.Type[ArchiveBackend]):
+    """Make an archive format known to scans, installs and the store, by extension."""
+    global _exts
+    BACKENDS[backend.kind] = backend
+    _exts = tuple(ext for backend in BACKENDS.values() for ext in backend.exts)
+    return backend
+
+
+def archive_exts() -> typing.Tuple[str, ...]:
+    return _exts
+
+
+def backend_for(path: str) -> typing.Optional[typing.Type[ArchiveBackend]]:
+    """The backend of the longest extension path ends with, e.g. .tar.gz over .gz."""
+    best = None
+    for backend in BACKENDS.values():
+        for ext in backend.exts:
+            if path.endswith(ext) and (best is None or len(ext) > len(best[0])):
+                best = (ext, backend)
+    return best[1] if best else None
+
+
+def archive_kind(path: str) -> typing.Optional[str]:
+    backend = backend_for(path)
+    return backend.kind if backend else None
+
+
+def archive_errors() -> typing.Tuple[typing.Type[Exception], ...]:
+    """The exceptions raised for unreadable archives, by any backend."""
+    errors: typing.Tuple[typing.Type[Exception], ...] = (ArchiveError,)
+    for backend in BACKENDS.values():
+        errors += backend.errors()
+    return errors
+
+
+def describe_archive_error(e: Exception, path: str):
+    if isinstance(e, ArchiveError):
+        return f"{e}: {path}"
+    for backend in BACKENDS.values():
+        if isinstance(e, backend.password_errors()):
+            return f"Password required for {path}"
+    return f"Bad {archive_kind(path) or 'archive'} file: {path}"
+
+
+def open_archive(
+    path: str, fileobj: typing.Optional[typing.IO[bytes]] = None
+) -> ArchiveBackend:
+    """Open the archive at path, or the archive named path read from fileobj."""
+    backend = backend_for(path)
+    if backend is None:
+        raise ValueError(f"Unsupported archive type: {path}")
+    profiler.count("archives_opened")
+    with profiler.span("archive.open"):
+        return backend(path, fileobj)
+
+
+def spool(f: typing.IO[bytes]):
+    """Copy a stream into a seekable file, in memory up to SPOOL_MAX_SIZE."""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    shutil.copyfileobj(f, spool)
+    spool.seek(0)
+    return spool
+
+
+@register_backend
+class ZipBackend(ArchiveBackend):
+    kind = "zip"
+    exts = (".zip",)
+
+    def __init__(self, path: str, fileobj: typing.Optional[typing.IO[bytes]] = None):
+        import zipfile
+
+        super().__init__(path, fileobj)
+        self.zip = zipfile.ZipFile(fileobj or path, "r")
+
+    def close(self):
+        self.zip.close()
+
+    @classmethod
+    def errors(cls):
+        import zipfile
+
+        return (zipfile.BadZipFile,)
+
+    def members(self):
+        return [
+            ArchiveMember(info.filename, info.file_size, info.CRC)
+            for info in self.zip.infolist()
+            if not info.is_dir()
+        ]
+
+    def open(self, name: str):
+        return self.zip.open(name)
+
+
+@register_backend
+class RarBackend(ArchiveBackend):
+    kind = "rar"
+    exts = (".rar",)
+
+    def __init__(self, path: str, fileobj: typing.Optional[typing.IO[bytes]] = None):
+        import rarfile
+
+        super().__init__(path, fileobj)
+        self.rar = rarfile.RarFile(fileobj or path, "r")
+        self.solid = self.rar.is_solid()
+
+    def close(self):
+        self.rar.close()
+
+    @classmethod
+    def errors(cls):
+        import rarfile
+
+        return (rarfile.BadRarFile, rarfile.PasswordRequired)
+
+    @classmethod
+    def password_errors(cls):
+        import rarfile
+
+        return (rarfile.PasswordRequired,)
+
+    def members(self):
+        return [
+            ArchiveMember(info.filename, info.file_size, info.CRC)
+            for info in self.rar.infolist()
+            if not info.is_dir()
+        ]
+
+    def open(self, name: str):
+        return self.rar.open(name)
+
+
+@register_backend
+class TarBackend(ArchiveBackend):
+    """Plain tars are read in place, compressed ones are solid: the compressed stream
+    is only read forward, so members are best read in archive order."""
+
+    kind = "tar"
+    exts = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+    def __init__(self, path: str, fileobj: typing.Optional[typing.IO[bytes]] = None):
+        import tarfile
+
+        super().__init__(path, fileobj)
+        self.tar = tarfile.open(path if fileobj is None else None, "r:*", fileobj)
+        self.solid = not path.endswith(".tar")
+        # leading ./ of members added with tar -C dir .
+        self.infos = {
+            info.name.removeprefix("./"): info
+            for info in self.tar.getmembers()
+            if info.isfile()
+        }
+
+    def close(self):
+        self.tar.close()
+
+    @classmethod
+    def errors(cls):
+        import gzip
+        import lzma
+        import tarfile
+        import zlib
+
+        # a truncated or corrupt compressed stream fails below tarfile
+        return (tarfile.TarError, EOFError, zlib.error, gzip.BadGzipFile, lzma.LZMAError)
+
+    def members(self):
+        return [ArchiveMember(name, info.size) for name, info in self.infos.items()]
+
+    def open(self, name: str):
+        return self.tar.extractfile(self.infos[name])
+
+
+@register_backend
+class SevenZipBackend(ArchiveBackend):
+    """7z archives, through py7zr if it is installed.
+    Reading a member decompresses its whole solid block, so stream() extracts all the
+    wanted members in one call, spooling them until they are yielded."""
+
+    kind = "7z"
+    exts = (".7z",)
+    solid = True
+
+    def __init__(self, path: str, fileobj: typing.Optional[typing.IO[bytes]] = None):
+        try:
+            # extraction goes through py7zr.io, which py7zr has since 0.22
+            import py7zr.io
+        except ImportError:
+            raise ArchiveError("py7zr 0.22 or later is required to read 7z archives")
+
+        super().__init__(path, fileobj)
+        self.sz = py7zr.SevenZipFile(fileobj or path, "r")
+
+    def close(self):
+        self.sz.close()
+
+    @classmethod
+    def errors(cls):
+        try:
+            import py7zr.exceptions
+        except ImportError:
+            return ()
+        return (py7zr.exceptions.ArchiveError, py7zr.exceptions.PasswordRequired)
+
+    @classmethod
+    def password_errors(cls):
+        try:
+            import py7zr.exceptions
+        except ImportError:
+            return ()
+        return (py7zr.exceptions.PasswordRequired,)
+
+    def members(self):
+        return [
+            ArchiveMember(info.filename, info.uncompressed, info.crc32)
+            for info in self.sz.list()
+            if not info.is_directory
+        ]
+
+    def __extract(self, names: typing.List[str]):
+        if not names:
+            # no targets means every member to py7zr
+            return {}
+        from py7zr.io import Py7zIO, WriterFactory
+
+        class SpoolIO(Py7zIO):
+            def __init__(self):
+                self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+
+            def write(self, s):
+                return self.file.write(s)
+
+            def read(self, size=None):
+                return self.file.read(-1 if size is None else size)
+
+            def seek(self, offset, whence=0):
+                return self.file.seek(offset, whence)
+
+            def flush(self):
+                self.file.flush()
+
+            def size(self):
+                return self.file.tell()
+
+        class SpoolFactory(WriterFactory):
+            def __init__(self):
+                self.files: dict[str, SpoolIO] = {}
+
+            def create(self, filename):
+                self.files[filename] = SpoolIO()
+                return self.files[filename]
+
+        factory = SpoolFactory()
+        self.sz.reset()
+        self.sz.extract(targets=names, factory=factory)
+        files = {}
+        for name, io in factory.files.items():
+            io.file.seek(0)
+            files[name] = io.file
+        return files
+
+    def open(self, name: str):
+        return self.__extract([name])[name]
+
+    def stream(self, names: typing.Iterable[str]):
+        names = list(names)
+        files = self.__extract(names)
+        try:
+            for name in names:
+                with files.pop(name) as f:
+                    yield name, f
+        finally:
+            for f in files.values():
+                f.close()
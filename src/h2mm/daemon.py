@@ -0,0 +1,283 @@
+from dataclasses import asdict
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+import typing
+from h2mm.mgr import H2MM
+
+# seconds to wait for a burst of filesystem events to settle before reindexing
+DEBOUNCE = 1.0
+
+
+def socket_address(cfg_dir: str):
+    """The unix socket of the daemon, or the file holding its localhost port
+    where unix sockets are not available."""
+    if hasattr(socket, "AF_UNIX"):
+        return os.path.join(cfg_dir, "h2mm.sock")
+    return os.path.join(cfg_dir, "h2mm.port")
+
+
+def request(cfg_dir: str, command: str, **args):
+    """Send a command to the daemon serving cfg_dir and return its result.
+    Raises OSError if no daemon is running."""
+    address = socket_address(cfg_dir)
+    if hasattr(socket, "AF_UNIX"):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        target = address
+    else:
+        with open(address, "r", encoding="utf-8") as f:
+            target = ("127.0.0.1", int(f.read()))
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+    with sock:
+        sock.connect(target)
+        sock.sendall(json.dumps({"command": command, "args": args}).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            response = json.loads(f.readline())
+
+    if "error" in response:
+        raise RuntimeError(response["error"])
+    return response["result"]
+
+
+def _walk_dirs(path: str):
+    yield path
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.startswith(".") or entry.name.startswith("_"):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    yield from _walk_dirs(entry.path)
+    except OSError:
+        pass
+
+
+class PollingWatcher:
+    """Detects changes by comparing the mtimes of every watched directory."""
+
+    def __init__(self, interval: float = 5.0):
+        self.interval = interval
+        self.roots: dict[str, typing.Tuple[str, bool]] = {}
+        self.snapshots: dict[str, dict[str, int]] = {}
+
+    def watch(self, key: str, path: str, recursive: bool = True):
+        self.roots[key] = (path, recursive)
+        self.snapshots[key] = self.__snapshot(path, recursive)
+
+    def __snapshot(self, path: str, recursive: bool):
+        snapshot = {}
+        for dir in _walk_dirs(path) if recursive else [path]:
+            try:
+                snapshot[dir] = os.stat(dir).st_mtime_ns
+            except OSError:
+                pass
+        return snapshot
+
+    def wait(self, timeout: float) -> typing.Set[str]:
+        time.sleep(min(timeout, self.interval))
+        changed = set()
+        # roots can grow from another thread when the daemon reloads its config
+        for key, (path, recursive) in list(self.roots.items()):
+            snapshot = self.__snapshot(path, recursive)
+            if snapshot != self.snapshots[key]:
+                self.snapshots[key] = snapshot
+                changed.add(key)
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Detects changes with inotify, watching every directory of each root."""
+
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    MASK = (
+        IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    )
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.keys: dict[int, str] = {}
+        self.roots: dict[str, typing.Tuple[str, bool]] = {}
+
+    def watch(self, key: str, path: str, recursive: bool = True):
+        self.roots[key] = (path, recursive)
+        for dir in _walk_dirs(path) if recursive else [path]:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir), self.MASK)
+            if wd >= 0:
+                self.keys[wd] = key
+
+    def wait(self, timeout: float) -> typing.Set[str]:
+        import select
+        import struct
+
+        changed = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return changed
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = struct.unpack_from("iIII", data, offset)
+            offset += 16 + length
+            if wd in self.keys:
+                changed.add(self.keys[wd])
+
+        # pick up directories created since the last watch
+        for key in changed:
+            self.watch(key, *self.roots[key])
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(poll_interval: float = 5.0):
+    """An inotify watcher where available, a polling one otherwise."""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(poll_interval)
+
+
+class H2MMDaemon:
+    """Holds an H2MM in memory, keeps its indexes up to date with the game data folder
+    and the resource folders, and serves queries over a local socket."""
+
+    def __init__(self, h2mm: H2MM, poll_interval: float = 5.0):
+        self.h2mm = h2mm
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+        self.watcher = make_watcher(poll_interval)
+        self.watched: typing.Set[str] = set()
+        self.cfg_dir = os.path.dirname(os.path.abspath(h2mm.cfg_path))
+
+    def sync(self):
+        """Reload everything if a command that does not go through the daemon, such as
+        store add or index import, rewrote the config and the indexes behind it."""
+        if not self.h2mm.config_changed():
+            return
+        logging.info("The config changed on disk, reloading the indexes")
+        self.h2mm.db.close()
+        self.h2mm = H2MM.load(self.h2mm.cfg_path)
+        self.h2mm.mod_install_index
+        self.watch_resources()
+
+    def watch_resources(self):
+        for resource in self.h2mm.cfg.resources:
+            if resource["path"] not in self.watched:
+                self.watcher.watch(resource["path"], resource["path"])
+                self.watched.add(resource["path"])
+
+    def handle(self, command: str, args: dict):
+        with self.lock:
+            self.sync()
+            if command == "ping":
+                return "pong"
+            elif command == "list_installed":
+                return self.h2mm.list_installed_mods()
+            elif command == "lookup":
+                return self.h2mm.lookup(args["hash"])
+            elif command == "reparse":
+                report = self.h2mm.reparse_resource_folder(
+                    args["path"], jobs=args.get("jobs", 1), fast=args.get("fast")
+                )
+                return asdict(report)
+            elif command == "install":
+                installed, methods = self.h2mm.install_mod(args["mod"])
+                return {"installed_file": installed, "methods": methods}
+        raise ValueError(f"Unknown command: {command}")
+
+    def refresh(self, key: str):
+        with self.lock:
+            self.sync()
+            if key == "data":
+                self.h2mm.reparse_installed_mods()
+            elif any(resource["path"] == key for resource in self.h2mm.cfg.resources):
+                report = self.h2mm.reparse_resource_folder(key)
+                logging.info(
+                    f"Reindexed {key}: {report.added} added, {report.changed} changed, "
+                    f"{report.removed} removed"
+                )
+
+    def watch(self):
+        with self.lock:
+            # load and refresh every index before serving
+            self.h2mm.mod_install_index
+            self.watcher.watch(
+                "data", os.path.join(self.h2mm.cfg.game_path, "data"), recursive=False
+            )
+            self.watch_resources()
+
+        while not self.stopped.is_set():
+            changed = self.watcher.wait(1.0)
+            if not changed:
+                continue
+            # let a burst of events settle, e.g. an archive still being written
+            while more := self.watcher.wait(DEBOUNCE):
+                changed |= more
+            for key in changed:
+                try:
+                    self.refresh(key)
+                except Exception:
+                    logging.exception(f"Failed to refresh {key}")
+
+    def serve_forever(self):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        message = json.loads(line)
+                        result = daemon.handle(message["command"], message.get("args", {}))
+                        response = {"result": result}
+                    except Exception as e:
+                        response = {"error": str(e)}
+                    response = json.dumps(response, ensure_ascii=False).encode() + b"\n"
+                    self.wfile.write(response)
+
+        address = socket_address(self.cfg_dir)
+        if hasattr(socket, "AF_UNIX"):
+            if os.path.exists(address):
+                os.remove(address)
+            server = socketserver.ThreadingUnixStreamServer(address, Handler)
+        else:
+            server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+            with open(address, "w", encoding="utf-8") as f:
+                f.write(str(server.server_address[1]))
+        server.daemon_threads = True
+
+        watcher = threading.Thread(target=self.watch, daemon=True)
+        watcher.start()
+        try:
+            server.serve_forever()
+        finally:
+            self.stopped.set()
+            server.server_close()
+            self.watcher.close()
+            if os.path.exists(address):
+                os.remove(address)
@@ -0,0 +1,208 @@
+import json
+import os
+import sqlite3
+import typing
+from h2mm.model import H2PathRef
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS refs (
+    hash TEXT NOT NULL,
+    resource_group TEXT NOT NULL,
+    path TEXT NOT NULL,
+    subpath TEXT NOT NULL,
+    PRIMARY KEY (resource_group, path, subpath, hash)
+);
+CREATE INDEX IF NOT EXISTS refs_hash ON refs (hash);
+CREATE INDEX IF NOT EXISTS refs_resource_group ON refs (resource_group);
+CREATE TABLE IF NOT EXISTS manifests (
+    hash TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS parts (
+    hash TEXT PRIMARY KEY,
+    sizes TEXT NOT NULL,
+    sample TEXT
+);
+CREATE TABLE IF NOT EXISTS installs (
+    hash TEXT PRIMARY KEY,
+    file TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS resource_units (
+    resource_group TEXT NOT NULL,
+    relpath TEXT NOT NULL,
+    unit TEXT NOT NULL,
+    PRIMARY KEY (resource_group, relpath)
+);
+"""
+
+# the write-ahead log is checkpointed into index.db every this many pages,
+# and truncated back to this size afterwards
+WAL_CHECKPOINT_PAGES = 1000
+WAL_SIZE_LIMIT = 64 * 1024 * 1024
+
+# json files used for the indexes before index.db, migrated once when it is created
+LEGACY_FILES = {
+    "refs": "modIndex.json",
+    "manifests": "manifestCache.json",
+    "installs": "installIndex.json",
+    "parts": "partIndex.json",
+    "resource_units": "treeIndex.json",
+}
+
+
+class H2IndexDB:
+    """SQLite storage for the mod indexes.
+    Every mutation is a single row statement in the current transaction,
+    so the cost of a save depends on what changed, not on the size of the library.
+    Commits are appended to a write-ahead log and checkpointed into the database
+    by SQLite, so a crash or power loss at any point leaves the last commit intact."""
+
+    def __init__(self, path: str):
+        self.path = path
+        exists = os.path.exists(path)
+        # the daemon uses the connection from its watcher and request threads, under its lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # in WAL mode NORMAL only syncs on checkpoints and never risks corruption
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(f"PRAGMA wal_autocheckpoint={WAL_CHECKPOINT_PAGES}")
+        self.conn.execute(f"PRAGMA journal_size_limit={WAL_SIZE_LIMIT}")
+        self.conn.executescript(SCHEMA)
+        if not exists:
+            self.migrate_json(os.path.dirname(path))
+            self.commit()
+
+    def close(self):
+        self.commit()
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.conn.close()
+
+    def commit(self):
+        self.conn.commit()
+
+    def load_refs(self) -> typing.Iterator[typing.Tuple[str, str, str, str]]:
+        """(hash, resource_group, path, subpath) rows, in the order they were added."""
+        return self.conn.execute(
+            "SELECT hash, resource_group, path, subpath FROM refs ORDER BY rowid"
+        )
+
+    def load_manifests(self) -> typing.Iterator[typing.Tuple[str, str]]:
+        """(hash, json) rows, left encoded until a manifest is read."""
+        return self.conn.execute("SELECT hash, data FROM manifests")
+
+    def load_parts(self) -> dict[str, list]:
+        return {
+            hash: [json.loads(sizes), sample]
+            for hash, sizes, sample in self.conn.execute(
+                "SELECT hash, sizes, sample FROM parts"
+            )
+        }
+
+    def load_installs(self) -> dict[str, str]:
+        return dict(self.conn.execute("SELECT hash, file FROM installs ORDER BY rowid"))
+
+    def load_units(self) -> dict[str, dict[str, list]]:
+        tree_index: dict[str, dict[str, list]] = {}
+        for resource_group, relpath, unit in self.conn.execute(
+            "SELECT resource_group, relpath, unit FROM resource_units ORDER BY rowid"
+        ):
+            tree_index.setdefault(resource_group, {})[relpath] = json.loads(unit)
+        return tree_index
+
+    def add_ref(self, hash: str, pathref: H2PathRef):
+        self.conn.execute(
+            "INSERT OR IGNORE INTO refs VALUES (?, ?, ?, ?)",
+            (hash, pathref.resourceGroup, pathref.path, pathref.subpath),
+        )
+
+    def remove_ref(self, hash: str, pathref: H2PathRef):
+        self.conn.execute(
+            "DELETE FROM refs WHERE hash = ? AND resource_group = ? AND path = ? AND subpath = ?",
+            (hash, pathref.resourceGroup, pathref.path, pathref.subpath),
+        )
+
+    def set_manifest(self, hash: str, manifest: typing.Optional[dict]):
+        if manifest is None:
+            self.conn.execute("DELETE FROM manifests WHERE hash = ?", (hash,))
+        else:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO manifests VALUES (?, ?)",
+                (hash, json.dumps(manifest, ensure_ascii=False, separators=(",", ":"))),
+            )
+
+    def set_part(self, hash: str, part: typing.Optional[list]):
+        if part is None:
+            self.conn.execute("DELETE FROM parts WHERE hash = ?", (hash,))
+        else:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO parts VALUES (?, ?, ?)",
+                (hash, json.dumps(part[0]), part[1]),
+            )
+
+    def set_install(self, hash: str, file: typing.Optional[str]):
+        if file is None:
+            self.conn.execute("DELETE FROM installs WHERE hash = ?", (hash,))
+        else:
+            self.conn.execute("INSERT OR REPLACE INTO installs VALUES (?, ?)", (hash, file))
+
+    def clear_installs(self):
+        self.conn.execute("DELETE FROM installs")
+
+    def set_unit(self, resource_group: str, relpath: str, unit: typing.Optional[list]):
+        if unit is None:
+            self.conn.execute(
+                "DELETE FROM resource_units WHERE resource_group = ? AND relpath = ?",
+                (resource_group, relpath),
+            )
+        else:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO resource_units VALUES (?, ?, ?)",
+                (resource_group, relpath, json.dumps(unit, ensure_ascii=False)),
+            )
+
+    def set_units(
+        self,
+        resource_group: str,
+        units: typing.Optional[dict[str, list]],
+        old_units: dict[str, list] = {},
+    ):
+        """Store the units of a resource folder, writing only the ones that differ from old_units."""
+        if units is None:
+            self.conn.execute(
+                "DELETE FROM resource_units WHERE resource_group = ?", (resource_group,)
+            )
+            return
+        self.conn.executemany(
+            "DELETE FROM resource_units WHERE resource_group = ? AND relpath = ?",
+            [(resource_group, relpath) for relpath in old_units.keys() - units.keys()],
+        )
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO resource_units VALUES (?, ?, ?)",
+            [
+                (resource_group, relpath, json.dumps(unit, ensure_ascii=False))
+                for relpath, unit in units.items()
+                if old_units.get(relpath) != unit
+            ],
+        )
+
+    def migrate_json(self, folder: str):
+        """Import the json index files that predate index.db, if any."""
+
+        def read(name):
+            path = os.path.join(folder, LEGACY_FILES[name])
+            if not os.path.exists(path):
+                return {}
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+
+        for hash, pathrefs in read("refs").items():
+            for pathref in pathrefs:
+                self.add_ref(hash, H2PathRef(**pathref))
+        for hash, manifest in read("manifests").items():
+            self.set_manifest(hash, manifest)
+        for hash, part in read("parts").items():
+            self.set_part(hash, part)
+        for hash, file in read("installs").items():
+            self.set_install(hash, file)
+        for resource_group, units in read("resource_units").items():
+            self.set_units(resource_group, units)
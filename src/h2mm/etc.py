@@ -1,44 +1,218 @@
+from collections import OrderedDict
+import json
 import os
+import threading
+import typing
+from h2mm.perf import profiler
 
+# the fingerprint journal is folded into a new snapshot past either limit
+JOURNAL_MAX_RECORDS = 20000
+JOURNAL_MAX_BYTES = 16 * 1024 * 1024
 
-class CacheOnModifiedDate:
-    """A decorator that caches function results based on the modification date of a file path.
-    The first parameter of the decorated function must be a string path.
-    Cache is invalidated if the file's modification time changes."""
 
-    def __init__(self):
-        self.cache = {}
-        self.mtimes = {}
+def atomic_write(path: str, data: str):
+    """Replace the file at path with data, so that it holds either the old or the new
+    content even if the process or the machine dies halfway."""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
 
-    def __call__(self, func):
-        def wrapper(path: str, *args, **kwargs):
-            if not isinstance(path, str):
-                raise TypeError("First argument must be a string path")
 
+def stat_identity(path: str):
+    """Return the (size, mtime_ns, inode) identity of a path, or None if it does not exist."""
+    profiler.count("files_stat")
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+class FingerprintCache:
+    """A persistent, size-bounded LRU cache for content fingerprints.
+    Entries are keyed on the decorated function and its arguments (path, archive subfolder, ...)
+    and are only returned while the stat identity recorded with them still matches.
+    It is persisted as a json snapshot plus a journal of the entries put since then."""
+
+    def __init__(self, max_entries: int = 50000):
+        self.path: typing.Optional[str] = None
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, list] = OrderedDict()
+        # entries put since the last drain, shipped back from worker processes
+        self.pending: typing.Dict[str, list] = {}
+        self.dirty = False
+        self.loaded = True
+        self.journal_records = 0
+        self.journal_bytes = 0
+        # scans hash from several threads at once
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def journal_path(self):
+        return os.path.splitext(self.path)[0] + ".journal"
+
+    def bind(self, path: str, max_entries: typing.Optional[int] = None):
+        """Use the cache file at path, loaded on first lookup and persisted to on save."""
+        if max_entries is not None:
+            self.max_entries = max_entries
+        if self.path == path:
+            return
+        self.path = path
+        self.entries.clear()
+        self.dirty = False
+        self.loaded = False
+
+    def load(self):
+        self.loaded = True
+        self.journal_records = 0
+        self.journal_bytes = 0
+        if self.path is None:
+            return
+        if os.path.exists(self.path):
             try:
-                mtime = os.path.getmtime(path)
-            except OSError:
-                # If file doesn't exist or other OS error, don't cache
-                return func(path, *args, **kwargs)
-
-            cache_key = (path, args, frozenset(kwargs.items()))
-
-            if (
-                cache_key in self.cache
-                and cache_key in self.mtimes
-                and self.mtimes[cache_key] == mtime
-            ):
-                return self.cache[cache_key]
-
-            # Clear old cache entry if exists
-            if cache_key in self.cache:
-                del self.cache[cache_key]
-                del self.mtimes[cache_key]
-
-            # Calculate and cache new result
-            result = func(path, *args, **kwargs)
-            self.cache[cache_key] = result
-            self.mtimes[cache_key] = mtime
-            return result
-
-        return wrapper
+                with open(self.path, "r", encoding="utf-8") as f:
+                    raw = json.load(f)
+            except (OSError, ValueError):
+                raw = []
+            for key, identity, value in raw[-self.max_entries :]:
+                self.entries[key] = [identity, value]
+
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                self.journal_records += 1
+                self.journal_bytes += len(line.encode())
+                try:
+                    key, identity, value = json.loads(line)
+                except ValueError:
+                    # the last record of a journal cut short by a crash
+                    continue
+                self.entries[key] = [identity, value]
+                self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def save(self):
+        """Append the entries put since the last save to the journal, and compact
+        once the journal grows past JOURNAL_MAX_RECORDS or JOURNAL_MAX_BYTES."""
+        with self.lock, profiler.span("cache.save"):
+            self.__save()
+
+    def __save(self):
+        if self.path is None or not self.dirty:
+            return
+        records = "".join(
+            json.dumps([key, identity, value], ensure_ascii=False) + "\n"
+            for key, (identity, value) in self.pending.items()
+        )
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(records)
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_records += len(self.pending)
+        self.journal_bytes += len(records.encode())
+        self.dirty = False
+        self.pending.clear()
+
+        if self.journal_records > JOURNAL_MAX_RECORDS or self.journal_bytes > JOURNAL_MAX_BYTES:
+            self.compact()
+
+    def compact(self):
+        """Write every entry to a new snapshot and start an empty journal."""
+        atomic_write(
+            self.path,
+            json.dumps(
+                [[key, identity, value] for key, (identity, value) in self.entries.items()],
+                ensure_ascii=False,
+            ),
+        )
+        # replaying the journal over the new snapshot is harmless if this is never reached
+        with open(self.journal_path, "w", encoding="utf-8"):
+            pass
+        self.journal_records = 0
+        self.journal_bytes = 0
+
+    def drain(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        return pending
+
+    def merge(self, entries: typing.Dict[str, list]):
+        for key, (identity, value) in entries.items():
+            self.put(key, identity, value)
+
+    def get(self, key: str, identity):
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != identity:
+                self.misses += 1
+                profiler.count("cache_misses")
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            profiler.count("cache_hits")
+            return entry[1]
+
+    def put(self, key: str, identity, value):
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            self.entries[key] = [identity, value]
+            self.entries.move_to_end(key)
+            self.pending[key] = [identity, value]
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def __call__(self, identity_func: typing.Callable[..., typing.Any], version: int = 0):
+        """Decorate a function whose result is cached while identity_func(*args) stays the same.
+        identity_func returning None disables caching for that call.
+        Bump version when the shape of the result changes to ignore older entries.
+        The wrapper's cached(*args) returns the cached result or None without computing it,
+        and store(result, *args) records a result that is already known."""
+
+        def decorator(func):
+            name = f"{func.__name__}@{version}" if version else func.__name__
+
+            def lookup(args):
+                identity = identity_func(*args)
+                if identity is None:
+                    return None, None, None
+                key = json.dumps([name, *args], ensure_ascii=False)
+                value = self.get(key, identity)
+                if isinstance(value, list):
+                    value = tuple(value)
+                return key, identity, value
+
+            def wrapper(*args):
+                key, identity, value = lookup(args)
+                if value is not None:
+                    return value
+                result = func(*args)
+                if key is not None:
+                    self.put(key, identity, list(result) if isinstance(result, tuple) else result)
+                return result
+
+            def cached(*args):
+                return lookup(args)[2]
+
+            def store(result, *args):
+                key, identity, _ = lookup(args)
+                if key is not None:
+                    self.put(key, identity, list(result) if isinstance(result, tuple) else result)
+
+            wrapper.__name__ = func.__name__
+            wrapper.__wrapped__ = func
+            wrapper.cached = cached
+            wrapper.store = store
+            return wrapper
+
+        return decorator
@@ -0,0 +1,112 @@
+import hashlib
+import queue
+import threading
+import time
+import typing
+from h2mm.perf import profiler
+
+# bytes read per call, large enough for sha256 and zlib to do most of their work without the GIL
+CHUNK_SIZE = 1024 * 1024
+# streams shorter than this many chunks are read inline, a reader thread would not pay off
+READ_AHEAD_MIN_CHUNKS = 4
+# chunks a reader thread may get ahead of the digest
+READ_AHEAD_DEPTH = 2
+
+_chunk_size = CHUNK_SIZE
+
+
+def set_chunk_size(size: int):
+    global _chunk_size
+    _chunk_size = size
+
+
+def chunk_size():
+    return _chunk_size
+
+
+def _record(kind: str, size: int, start: float):
+    if profiler.enabled:
+        profiler.count("bytes_hashed", size)
+        profiler.rate(f"hash.{kind}", size, time.perf_counter() - start)
+
+
+def hash_file(hasher, path: str, kind: str = "file") -> int:
+    """Feed the content of a file into hasher, returns its size.
+    hashlib.file_digest reads into one reused buffer and digests it without the GIL."""
+    start = time.perf_counter() if profiler.enabled else 0.0
+    with open(path, "rb") as f:
+        if hasattr(hashlib, "file_digest"):
+            hashlib.file_digest(f, lambda: hasher)
+        else:
+            buffer = bytearray(_chunk_size)
+            view = memoryview(buffer)
+            while size := f.readinto(buffer):
+                hasher.update(view[:size])
+        size = f.tell()
+    _record(kind, size, start)
+    return size
+
+
+class _ReadAhead:
+    """Reads a stream from a thread, READ_AHEAD_DEPTH chunks ahead of the consumer,
+    so decompression or I/O overlaps with digesting."""
+
+    def __init__(self, f: typing.IO[bytes], size: int):
+        self.queue: queue.Queue = queue.Queue(maxsize=READ_AHEAD_DEPTH)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.__read, args=(f, size), daemon=True)
+        self.thread.start()
+
+    def __read(self, f: typing.IO[bytes], size: int):
+        try:
+            while not self.stopped.is_set():
+                chunk = f.read(size)
+                self.__put(chunk)
+                if not chunk:
+                    return
+        except BaseException as e:
+            self.__put(e)
+
+    def __put(self, item):
+        # a consumer that stops early sets stopped instead of draining the queue
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if isinstance(item, BaseException):
+                raise item
+            if not item:
+                return
+            yield item
+
+    def close(self):
+        # the stream is only handed back once the thread is done with it
+        self.stopped.set()
+        self.thread.join()
+
+
+def iter_chunks(f: typing.IO[bytes], size: int = -1, kind: str = "stream"):
+    """Yield the content of a stream in chunks of chunk_size() bytes.
+    Streams of unknown size (-1) or of at least READ_AHEAD_MIN_CHUNKS chunks are read
+    ahead by a thread; kind names the source in the --profile throughput."""
+    start = time.perf_counter() if profiler.enabled else 0.0
+    read = 0
+    reader = None
+    if 0 <= size < _chunk_size * READ_AHEAD_MIN_CHUNKS:
+        chunks: typing.Iterable[bytes] = iter(lambda: f.read(_chunk_size), b"")
+    else:
+        chunks = reader = _ReadAhead(f, _chunk_size)
+    try:
+        for chunk in chunks:
+            read += len(chunk)
+            yield chunk
+    finally:
+        if reader is not None:
+            reader.close()
+    _record(kind, read, start)
@@ -0,0 +1,218 @@
+from array import array
+import json
+import sys
+import typing
+from h2mm.model import H2Mod, H2PathRef
+
+# rows of a hash or a path: a single row is kept as a plain int, more as an array
+Rows = typing.Union[int, array]
+
+
+def _rows(rows: typing.Optional[Rows]) -> typing.Iterable[int]:
+    if rows is None:
+        return ()
+    return (rows,) if isinstance(rows, int) else rows
+
+
+def _add_row(rows: typing.Optional[Rows], row: int) -> Rows:
+    if rows is None:
+        return row
+    if isinstance(rows, int):
+        return array("I", (rows, row))
+    rows.append(row)
+    return rows
+
+
+def _remove_row(rows: Rows, row: int) -> typing.Optional[Rows]:
+    if isinstance(rows, int):
+        return None
+    rows.remove(row)
+    return rows[0] if len(rows) == 1 else rows
+
+
+class H2RefTable(typing.Mapping[str, typing.List[H2PathRef]]):
+    """mod_res_index in columns: hash -> refs as a read-only mapping.
+    Resource groups are interned to small ids, paths and subpaths are interned strings,
+    and H2PathRef views are only built when a hash is looked up.
+    Rows are also indexed by resource group and path, for prune and which."""
+
+    def __init__(self):
+        self.groups: typing.List[str] = []
+        self.group_ids: dict[str, int] = {}
+        self.group_col = array("I")
+        self.path_col: typing.List[typing.Optional[str]] = []
+        self.subpath_col: typing.List[typing.Optional[str]] = []
+        self.hash_col: typing.List[typing.Optional[str]] = []
+        self.free = array("I")
+        self.by_hash: dict[str, Rows] = {}
+        # group id -> path -> rows
+        self.by_path: typing.List[dict[str, Rows]] = []
+
+    @classmethod
+    def from_rows(cls, rows: typing.Iterable[typing.Tuple[str, str, str, str]]):
+        table = cls()
+        for hash, group, path, subpath in rows:
+            table.add_row(hash, group, path, subpath)
+        return table
+
+    def __group_id(self, group: str):
+        if group not in self.group_ids:
+            self.group_ids[group] = len(self.groups)
+            self.groups.append(sys.intern(group))
+            self.by_path.append({})
+        return self.group_ids[group]
+
+    def __view(self, row: int):
+        return H2PathRef.normalized(
+            self.groups[self.group_col[row]], self.path_col[row], self.subpath_col[row]
+        )
+
+    def __getitem__(self, hash: str) -> typing.List[H2PathRef]:
+        return [self.__view(row) for row in _rows(self.by_hash[hash])]
+
+    def __contains__(self, hash: object):
+        return hash in self.by_hash
+
+    def __iter__(self):
+        return iter(self.by_hash)
+
+    def __len__(self):
+        return len(self.by_hash)
+
+    def count_refs(self):
+        return len(self.hash_col) - len(self.free)
+
+    def find_row(self, group: str, path: str, subpath: str) -> typing.Optional[int]:
+        group_id = self.group_ids.get(group)
+        if group_id is None:
+            return None
+        for row in _rows(self.by_path[group_id].get(path)):
+            if self.subpath_col[row] == subpath:
+                return row
+        return None
+
+    def find(self, pathref: H2PathRef) -> typing.Optional[str]:
+        """The hash indexed for a ref, if any."""
+        row = self.find_row(pathref.resourceGroup, pathref.path, pathref.subpath)
+        return None if row is None else self.hash_col[row]
+
+    def at(self, group: str, path: str) -> typing.List[typing.Tuple[str, H2PathRef]]:
+        """(hash, ref) of every mod indexed from one path of a resource group."""
+        group_id = self.group_ids.get(group)
+        if group_id is None:
+            return []
+        return [
+            (self.hash_col[row], self.__view(row))
+            for row in _rows(self.by_path[group_id].get(path))
+        ]
+
+    def paths(self, group: str) -> typing.List[str]:
+        group_id = self.group_ids.get(group)
+        return [] if group_id is None else list(self.by_path[group_id])
+
+    def add_row(self, hash: str, group: str, path: str, subpath: str):
+        group_id = self.__group_id(group)
+        path = sys.intern(path)
+        subpath = sys.intern(subpath)
+        if self.free:
+            row = self.free.pop()
+            self.group_col[row] = group_id
+            self.path_col[row] = path
+            self.subpath_col[row] = subpath
+            self.hash_col[row] = hash
+        else:
+            row = len(self.hash_col)
+            self.group_col.append(group_id)
+            self.path_col.append(path)
+            self.subpath_col.append(subpath)
+            self.hash_col.append(hash)
+        self.by_hash[hash] = _add_row(self.by_hash.get(hash), row)
+        by_path = self.by_path[group_id]
+        by_path[path] = _add_row(by_path.get(path), row)
+
+    def add(self, hash: str, pathref: H2PathRef):
+        # the hash key is shared with the column instead of stored twice
+        for key in _rows(self.by_hash.get(hash)):
+            hash = self.hash_col[key]
+            break
+        self.add_row(hash, pathref.resourceGroup, pathref.path, pathref.subpath)
+
+    def remove(self, hash: str, pathref: H2PathRef):
+        """Remove a ref, returns whether the hash still has any."""
+        row = self.find_row(pathref.resourceGroup, pathref.path, pathref.subpath)
+        if row is not None and self.hash_col[row] == hash:
+            by_path = self.by_path[self.group_col[row]]
+            path = self.path_col[row]
+            rows = _remove_row(by_path[path], row)
+            if rows is None:
+                del by_path[path]
+            else:
+                by_path[path] = rows
+            rows = _remove_row(self.by_hash[hash], row)
+            if rows is None:
+                del self.by_hash[hash]
+            else:
+                self.by_hash[hash] = rows
+            self.path_col[row] = self.subpath_col[row] = self.hash_col[row] = None
+            self.free.append(row)
+        return hash in self.by_hash
+
+
+class H2ManifestTable(typing.Mapping[str, H2Mod]):
+    """manifest_index as hash -> compact json text, read as H2Mod views.
+    The decoded manifest is available through manifest() for storage and comparison."""
+
+    def __init__(self, rows: typing.Iterable[typing.Tuple[str, str]] = ()):
+        self.data: dict[str, str] = dict(rows)
+        self._assets: typing.Optional[dict[str, typing.Set[str]]] = None
+
+    def __getitem__(self, hash: str) -> H2Mod:
+        return H2Mod.from_manifest(json.loads(self.data[hash]))
+
+    def __contains__(self, hash: object):
+        return hash in self.data
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def manifest(self, hash: str) -> typing.Optional[dict]:
+        data = self.data.get(hash)
+        return None if data is None else json.loads(data)
+
+    def set(self, hash: str, manifest: dict):
+        if self._assets is not None:
+            self.__unindex(hash)
+        self.data[hash] = json.dumps(manifest, ensure_ascii=False, separators=(",", ":"))
+        if self._assets is not None:
+            self.__index(hash)
+
+    def pop(self, hash: str):
+        if self._assets is not None:
+            self.__unindex(hash)
+        return self.data.pop(hash, None)
+
+    def assets(self) -> dict[str, typing.Set[str]]:
+        """Conflict index, asset key -> hashes of the mods that overwrite it without
+        marking it ignorable. Built on first use, then kept up to date by set and pop."""
+        if self._assets is None:
+            self._assets = {}
+            for hash in self.data:
+                self.__index(hash)
+        return self._assets
+
+    def __index(self, hash: str):
+        for asset in self[hash].conflicting_overwrites:
+            self._assets.setdefault(asset, set()).add(hash)
+
+    def __unindex(self, hash: str):
+        if hash not in self.data:
+            return
+        for asset in self[hash].conflicting_overwrites:
+            hashes = self._assets.get(asset)
+            if hashes is not None:
+                hashes.discard(hash)
+                if not hashes:
+                    del self._assets[asset]
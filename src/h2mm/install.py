@@ -0,0 +1,115 @@
+import os
+import re
+import shutil
+import typing
+from h2mm.model import H2PathRef
+from h2mm.utils import open_nested, plan_archive, verify_and_get_target_file
+
+# ioctl request to share the extents of one file with another on btrfs/xfs
+FICLONE = 0x40049409
+COPY_BUFFER_SIZE = 1024 * 1024
+
+PATCH_RE = re.compile(r"^(?P<base>.+?)\.patch_(?P<num>\d+)(?:\..*)?$")
+
+
+def next_patch_name(data_path: str, target: str):
+    """Name the installed target after the archive it patches, with the next free patch_N."""
+    match = PATCH_RE.match(target)
+    base = match.group("base") if match else target
+    used = [
+        int(match.group("num"))
+        for file in os.listdir(data_path)
+        if (match := PATCH_RE.match(file)) and match.group("base") == base
+    ]
+    return f"{base}.patch_{max(used) + 1 if used else 0}"
+
+
+def _reflink(src: str, dst: str):
+    import fcntl
+
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def _copy_file_range(src: str, dst: str):
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        remaining = os.fstat(s.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(s.fileno(), d.fileno(), remaining)
+            if copied == 0:
+                break
+            remaining -= copied
+
+
+def materialize_file(src: str, dst: str):
+    """Put a copy of src at dst as cheaply as the filesystem allows: a reflink,
+    then a hardlink, then an in-kernel copy. Returns the method that was used."""
+    tmp = dst + ".h2mmtmp"
+    same_device = os.stat(src).st_dev == os.stat(os.path.dirname(dst)).st_dev
+    methods: typing.List[typing.Tuple[str, typing.Callable[[str, str], None]]] = []
+    if same_device:
+        methods += [("reflink", _reflink), ("hardlink", os.link)]
+    if hasattr(os, "copy_file_range"):
+        methods.append(("copy_file_range", _copy_file_range))
+    # shutil uses sendfile/fcopyfile/CopyFile where the platform has them
+    methods.append(("copy", shutil.copyfile))
+
+    for method, copy in methods:
+        try:
+            copy(src, tmp)
+        except (OSError, ImportError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            continue
+        os.replace(tmp, dst)
+        return method
+    raise RuntimeError(f"Failed to copy {src} to {dst}")
+
+
+def source_parts(pathref: H2PathRef):
+    """The target, .gpu_resources and .stream of an indexed mod, as names
+    relative to its folder or archive folder, and the target name."""
+    path = os.path.join(pathref.resourceGroup, pathref.path)
+    if os.path.isdir(path):
+        files = [
+            file for file in os.listdir(path) if os.path.isfile(os.path.join(path, file))
+        ]
+        target = verify_and_get_target_file(files)
+        return [
+            target + suffix
+            for suffix in ("", ".gpu_resources", ".stream")
+            if target + suffix in files
+        ]
+
+    with open_nested(path, pathref.subpath) as (archive, folder):
+        members = archive.namelist()
+    parts, _ = plan_archive(members)[folder]
+    return [part[len(folder) :] for part in parts]
+
+
+def install_parts(pathref: H2PathRef, data_path: str, installed: typing.Optional[str] = None):
+    """Materialize the patch triple of an indexed mod into the game data folder,
+    as installed or the next free patch_N. Archive members are streamed straight
+    to their destination. Returns the installed target name and the method used per part."""
+    parts = source_parts(pathref)
+    if installed is None:
+        installed = next_patch_name(data_path, parts[0])
+    path = os.path.join(pathref.resourceGroup, pathref.path)
+
+    # the target is written last so a partial install is never picked up as a patch
+    methods = {}
+    if os.path.isdir(path):
+        for part in reversed(parts):
+            dst = os.path.join(data_path, installed + part[len(parts[0]) :])
+            methods[part] = materialize_file(os.path.join(path, part), dst)
+        return installed, methods
+
+    with open_nested(path, pathref.subpath) as (archive, folder):
+        for member, f in archive.stream([folder + part for part in reversed(parts)]):
+            part = member[len(folder) :]
+            dst = os.path.join(data_path, installed + part[len(parts[0]) :])
+            with open(dst + ".h2mmtmp", "wb") as out:
+                shutil.copyfileobj(f, out, COPY_BUFFER_SIZE)
+            os.replace(dst + ".h2mmtmp", dst)
+            methods[part] = "stream"
+    return installed, methods
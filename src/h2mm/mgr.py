@@ -1,23 +1,66 @@
 from dataclasses import dataclass, field, asdict
-import json
 import logging
 import os
-import shutil
+import time
 import typing
-import zipfile
-import toml
-from h2mm.model import H2MMCfg, H2ModRes, H2PathRef, H2Mod
-from h2mm.utils import calculate_hash, get_all_eligible_pairs, smart_get_meta
-import rarfile
+from h2mm.db import H2IndexDB
+from h2mm.etc import atomic_write
+from h2mm.hashing import set_chunk_size
+from h2mm.install import PATCH_RE, install_parts, source_parts
+from h2mm.index import H2ManifestTable, H2RefTable
+from h2mm.model import H2MMCfg, H2Mod, H2PathRef, H2ScanEvent, H2ScanReport
+from h2mm.perf import profiler
+from h2mm.plan import H2InstallPlan
+from h2mm.profiles import H2Profiles, InstallState
+from h2mm.store import H2Store
+from h2mm.utils import (
+    archive_errors,
+    archive_exts,
+    archive_kind,
+    calculate_hash,
+    fast_id_sizes,
+    fingerprint_cache,
+    generate_folder_meta,
+    generate_triple_sample,
+    generate_zip_meta,
+    get_part_sample,
+    is_fast_id,
+    is_sample_id,
+    sample_id,
+    scan_process_pool,
+    scan_unit,
+    scan_unit_worker,
+    scan_units,
+    triple_sizes,
+    unit_size,
+    walk_resource_units,
+)
+
+# a long scan commits after this many units or seconds, whichever comes first
+SCAN_CHECKPOINT_UNITS = 64
+SCAN_CHECKPOINT_SECONDS = 5.0
+
 
 @dataclass
 class H2MM:
     cfg: H2MMCfg
     cfg_path: str
-    # hash,
-    mod_res_index: dict[str, typing.List[H2PathRef]] = field(default_factory=dict)
-    mod_install_index: dict[str, str] = field(default_factory=dict)
-    manifest_index: dict[str, H2Mod] = field(default_factory=dict)
+    # the indexes are loaded, and refreshed if stale, on first access through their properties
+    _mod_res_index: typing.Optional[H2RefTable] = field(
+        default=None, init=False, repr=False
+    )
+    _mod_install_index: typing.Optional[dict[str, str]] = field(
+        default=None, init=False, repr=False
+    )
+    _manifest_index: typing.Optional[H2ManifestTable] = field(
+        default=None, init=False, repr=False
+    )
+    _part_index: typing.Optional[dict[str, list]] = field(
+        default=None, init=False, repr=False
+    )
+    _tree_index: typing.Optional[dict[str, dict[str, list]]] = field(
+        default=None, init=False, repr=False
+    )
 
     @classmethod
     def load(cls, cfg_path: typing.Optional[str] = None):
@@ -30,55 +73,140 @@ class H2MM:
                 f"cfg file not found: {cfg_path}, use H2MMCfg.create to create a new one"
             )
 
+        import toml
+
         with open(cfg_path, "r", encoding="utf-8") as f:
             cfg = H2MMCfg(**toml.load(f))
 
         return cls(cfg=cfg, cfg_path=cfg_path)
 
+    @property
+    def mod_res_index(self) -> H2RefTable:
+        """hash -> refs of every indexed mod, also indexed by resource group and path"""
+        if self._mod_res_index is None:
+            self.__load_mod_resource()
+        return self._mod_res_index
+
+    @property
+    def manifest_index(self) -> H2ManifestTable:
+        if self._manifest_index is None:
+            self.__load_mod_resource()
+        return self._manifest_index
+
+    @property
+    def part_index(self) -> dict[str, list]:
+        """hash -> [part sizes, sampled digest] of every indexed mod"""
+        if self._part_index is None:
+            self.__load_mod_resource()
+        return self._part_index
+
+    @property
+    def tree_index(self) -> dict[str, dict[str, list]]:
+        """resource folder -> relpath -> [kind, identity] of every unit seen by the last scan"""
+        if self._tree_index is None:
+            self.__load_mod_resource()
+        return self._tree_index
+
+    @property
+    def mod_install_index(self) -> dict[str, str]:
+        if self._mod_install_index is None:
+            self.__load_install_index()
+        return self._mod_install_index
+
     def __load_install_index(self):
-        # get or create the installIndex.json at dir(game_path)
-        if not os.path.exists(self.install_index_path):
-            with open(self.install_index_path, "w", encoding="utf-8") as f:
-                json.dump({}, f)
-        else:
-            with open(self.install_index_path, "r", encoding="utf-8") as f:
-                self.mod_install_index = json.load(f)
+        restored = self.profiles.recover()
+        if restored is not None:
+            logging.warning("An interrupted profile switch was rolled back")
+            self._mod_install_index = self.db.load_installs()
+            self.__set_installs(restored)
+            return
+
+        # compare time for last_install_check and the game_path mdate
+        if self.cfg.last_install_check < os.path.getmtime(self.cfg.game_path):
+            self.reparse_installed_mods()
+            return
+
+        self._mod_install_index = self.db.load_installs()
+        if self.__match_installed():
+            self.__save_install_index()
+            self.__save_mod_resource()
 
     def __save_config(self):
-        with open(self.cfg_path, "w", encoding="utf-8") as f:
-            toml.dump(asdict(self.cfg), f)
+        import toml
+
+        if self.config_changed():
+            self.__merge_saved_config()
+        data = toml.dumps(asdict(self.cfg))
+        if data != self.saved_config:
+            atomic_write(self.cfg_path, data)
+            self.saved_config = data
+        self.cfg_mtime = self.__cfg_mtime()
+
+    def __cfg_mtime(self):
+        try:
+            return os.stat(self.cfg_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def config_changed(self) -> bool:
+        """Whether another process, such as the CLI next to a daemon, rewrote the config
+        since this one loaded or saved it."""
+        return self.__cfg_mtime() != self.cfg_mtime
+
+    def __merge_saved_config(self):
+        """Adopt the config on disk, keeping the scan times recorded here
+        for the resource folders both know."""
+        import toml
+
+        with open(self.cfg_path, "r", encoding="utf-8") as f:
+            saved = H2MMCfg(**toml.load(f))
+        scanned = {resource["path"]: resource["last_modified"] for resource in self.cfg.resources}
+        for resource in saved.resources:
+            if resource["path"] in scanned:
+                resource["last_modified"] = max(
+                    resource["last_modified"], scanned[resource["path"]]
+                )
+        saved.last_install_check = max(saved.last_install_check, self.cfg.last_install_check)
+        self.cfg = saved
+        self.saved_config = None
 
     def __save_install_index(self):
-        with open(self.install_index_path, "w", encoding="utf-8") as f:
-            json.dump(self.mod_install_index, f, indent=2)
+        self.db.commit()
+        fingerprint_cache.save()
 
     def __post_init__(self):
-        self.install_index_path = os.path.join(
-            os.path.dirname(self.cfg_path), "installIndex.json"
+        self.db_path = os.path.join(os.path.dirname(self.cfg_path), "index.db")
+        self.db = H2IndexDB(self.db_path)
+        self.fingerprint_cache_path = os.path.join(
+            os.path.dirname(self.cfg_path), "fingerprintCache.json"
         )
-        self.mod_index_path = os.path.join(
-            os.path.dirname(self.cfg_path), "modIndex.json"
+        fingerprint_cache.bind(
+            self.fingerprint_cache_path, self.cfg.fingerprint_cache_size
         )
-        self.manifest_index_path = os.path.join(
-            os.path.dirname(self.cfg_path), "manifestCache.json"
+        set_chunk_size(self.cfg.hash_chunk_size)
+        self.saved_config: typing.Optional[str] = None
+        self.cfg_mtime = self.__cfg_mtime()
+        # resource folder -> mtime when its scan started, recorded once the scan finishes
+        self.__scan_mtimes: dict[str, float] = {}
+        self.store = H2Store(
+            os.path.join(os.path.dirname(os.path.abspath(self.cfg_path)), "store")
+        )
+        self.profiles = H2Profiles(
+            os.path.join(os.path.dirname(os.path.abspath(self.cfg_path)), "profiles"),
+            os.path.join(self.cfg.game_path, "data"),
         )
-
-        # compare time for last_install_check and the game_path mdate
-        if self.cfg.last_install_check < os.path.getmtime(self.cfg.game_path):
-            self.reparse_installed_mods()
-        else:
-            self.__load_install_index()
-
-        self.__load_mod_resource()
 
     def reparse_installed_mods(self):
         self.cfg.last_install_check = os.path.getmtime(self.cfg.game_path)
         self.__save_config()
 
-        self.mod_install_index.clear()
+        self._mod_install_index = {}
+        self.db.clear_installs()
 
-        for file in os.listdir(os.path.join(self.cfg.game_path, "data")):
-            if not os.path.isfile(os.path.join(self.cfg.game_path, "data", file)):
+        data_path = os.path.join(self.cfg.game_path, "data")
+        by_sizes = self.__parts_by_sizes()
+        for file in os.listdir(data_path):
+            if not os.path.isfile(os.path.join(data_path, file)):
                 continue
 
             if "patch_" not in file:
@@ -88,16 +216,49 @@ class H2MM:
             if "patch_" not in ext:
                 continue
 
-            hash = calculate_hash(os.path.join(self.cfg.game_path, "data"), file)
+            with profiler.span("installed.identify"):
+                hash = self.__identify_installed(data_path, file, by_sizes)
 
             if hash in self.mod_install_index:
                 raise RuntimeError(
                     f"mod hash conflict: {hash}, {file} with {self.mod_install_index[hash]}"
                 )
 
-            self.mod_install_index[hash] = file
+            self.__set_install(hash, file)
 
         self.__save_install_index()
+        if self.__match_installed():
+            self.__save_install_index()
+            self.__save_mod_resource()
+
+    def __identify_installed(
+        self, data_path: str, file: str, by_sizes: dict[tuple, typing.List[str]]
+    ) -> str:
+        """Identify an installed patch triple, hashing as little as possible.
+        A triple whose stat identity is unchanged since the last check reuses its sha256.
+        Otherwise it is matched against the library by part sizes, then by a sampled digest,
+        and only hashed in full if a library mod survives both; unmatched triples are keyed
+        by their sample_id."""
+        hash = calculate_hash.cached(data_path, file)
+        if hash is not None:
+            return hash
+
+        sizes, sample = generate_triple_sample(data_path, file)
+        candidates = by_sizes.get(tuple(sizes), [])
+        if any(self.part_index[candidate][1] in (None, sample) for candidate in candidates):
+            return calculate_hash(data_path, file)
+        return sample_id(sizes, sample)
+
+    def __parts_by_sizes(self) -> dict[tuple, typing.List[str]]:
+        by_sizes: dict[tuple, typing.List[str]] = {}
+        for hash, pathrefs in self.mod_res_index.items():
+            if hash not in self.part_index:
+                try:
+                    self.__set_part(hash, get_part_sample(hash, pathrefs[0]))
+                except (OSError, ValueError, *archive_errors()):
+                    continue
+            by_sizes.setdefault(tuple(self.part_index[hash][0]), []).append(hash)
+        return by_sizes
 
     def register_new_mod(self, path: str):
         # check which resource folder the mod is in
@@ -109,73 +270,87 @@ class H2MM:
         if folder is None:
             raise Exception(f"Mod {path} not found in any resource folder")
 
-    def add_resource(self, path: str, toResource: str | None = None):
-        if toResource is None:
-            if len(self.cfg.resources) == 0:
-                raise RuntimeError(
-                    "No resource folder found", "use add_resource_folder to add one"
-                )
-            toResource = self.cfg.resources[0]["path"]
-
-        toResource = os.path.abspath(toResource)
-
-        if not os.path.exists(toResource):
-            raise RuntimeError(f"Resource folder not found: {toResource}")
-
+    def add_resource(self, path: str):
+        """Import the mods of a folder or archive into the store and index them.
+        Mods the store already holds are not copied again. Returns the hashes that were added."""
         if not os.path.exists(path):
             raise RuntimeError(f"Resource file not found: {path}")
 
-        hash, pathref, manifest = smart_get_meta(path, toResource)
-
-        shutil.copy(path, os.path.join(os.path.basename(toResource), hash))
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            root, units = path, list(walk_resource_units(path))
+        elif path.endswith(archive_exts()):
+            st = os.stat(path)
+            root = os.path.dirname(path)
+            units = [(os.path.basename(path), [archive_kind(path), [st.st_size, st.st_mtime_ns]])]
+        else:
+            raise RuntimeError(f"Not a folder or an archive: {path}")
 
-        if hash not in self.mod_res_index:
-            self.mod_res_index[hash] = []
+        added = []
+        for relpath, metas, warning in scan_units(root, units):
+            if warning is not None:
+                logging.warning(warning)
+                continue
+            for hash, pathref, manifest in metas:
+                if self.store.add(hash, pathref, manifest):
+                    # the stored copy has the same content, no need to hash it again
+                    generate_folder_meta.store((hash, manifest), self.store.mod_path(hash))
+                    added.append(hash)
 
-        if manifest:
-            self.manifest_index[hash] = manifest
+        self.__index_store()
+        return added
 
-        if pathref in self.mod_res_index[hash]:
-            raise RuntimeError(f"Mod resource {path} already exists")
+    def remove_resource(self, query: str):
+        """Remove a mod from the store, gc reclaims its files once nothing links to them."""
+        hash = self.find_mod(query)
+        if hash not in self.store:
+            raise RuntimeError(f"Mod {query} is not in the store")
+        self.store.remove(hash)
+        self.__index_store()
+        return hash
 
-        self.mod_res_index[hash].append(pathref)
+    def __index_store(self):
+        os.makedirs(self.store.mods, exist_ok=True)
+        if any(resource["path"] == self.store.mods for resource in self.cfg.resources):
+            self.reparse_resource_folder(self.store.mods)
+        else:
+            self.add_resource_folder(self.store.mods)
 
     def __load_mod_resource(self):
-        if os.path.exists(self.mod_index_path):
-            with open(self.mod_index_path, "r", encoding="utf-8") as f:
-                raw = json.load(f)
-                self.mod_res_index = {
-                    hash: [H2PathRef(**pathref) for pathref in pathrefs]
-                    for hash, pathrefs in raw.items()
-                }
+        with profiler.span("index.load"):
+            self._mod_res_index = H2RefTable.from_rows(self.db.load_refs())
+            self._manifest_index = H2ManifestTable(self.db.load_manifests())
+            self._part_index = self.db.load_parts()
+            self._tree_index = self.db.load_units()
 
-        if os.path.exists(self.manifest_index_path):
-            with open(self.manifest_index_path, "r", encoding="utf-8") as f:
-                self.manifest_index = json.load(f)
-
-        # compare to each modified in resource
-        for resource in self.cfg.resources:
-            if os.path.getmtime(resource["path"]) > resource["last_modified"]:
-                self.reparse_resource_folder(resource["path"])
+        # rescan the resource folders modified since their last scan, concurrently
+        stale = [
+            resource["path"]
+            for resource in self.cfg.resources
+            if os.path.getmtime(resource["path"]) > resource["last_modified"]
+        ]
+        if len(stale) == 1:
+            self.reparse_resource_folder(stale[0])
+        elif stale:
+            self.reparse_resource_folders(stale)
 
     def __save_mod_resource(self):
-        with open(self.mod_index_path, "w", encoding="utf-8") as f:
-            serialized = {
-                hash: [asdict(pathref) for pathref in pathrefs]
-                for hash, pathrefs in self.mod_res_index.items()
-            }
-            json.dump(serialized, f, indent=2, ensure_ascii=False)
-
-        with open(self.manifest_index_path, "w", encoding="utf-8") as f:
-            json.dump(self.manifest_index, f, indent=2, ensure_ascii=False)
+        with profiler.span("index.save"):
+            self.db.commit()
+            fingerprint_cache.save()
+            self.__save_config()
 
-        self.__save_config()
+    def __drop_refs(self, group: str, paths: typing.Optional[typing.Set[str]] = None):
+        """Remove the refs of a resource group, optionally only those whose path is in paths.
+        Manifests left without any ref are dropped as well."""
+        group = group.replace("\\", "/")
+        for path in self.mod_res_index.paths(group) if paths is None else paths:
+            for hash, pathref in self.mod_res_index.at(group, path):
+                self.__remove_ref(hash, pathref)
 
     def prune_resource_folder(self, path: str):
-        for hash, pathrefs in self.mod_res_index.items():
-            for pathref in pathrefs:
-                if pathref.resourceGroup == path:
-                    self.mod_res_index[hash].remove(pathref)
+        self.__drop_refs(path)
+        self.__set_units(path, None)
 
         self.__save_mod_resource()
 
@@ -193,12 +368,282 @@ class H2MM:
                 return
             raise e
 
-        self.cfg.resources.append(
-            {"path": path, "last_modified": os.path.getmtime(path)}
-        )
+        # loaded first, so the folder is not seen as stale and scanned twice
+        self.tree_index
+        self.mod_res_index
+        # never scanned until the scan below finishes, so an interrupted one is resumed
+        self.cfg.resources.append({"path": path, "last_modified": 0})
+        self.__save_config()
         self.reparse_resource_folder(path)
 
-    def reparse_resource_folder(self, path: str | int):
+    def export_index(
+        self,
+        out: str,
+        root: typing.Optional[str] = None,
+        paths: typing.Optional[typing.List[str]] = None,
+    ):
+        """Write the refs, manifests, part samples and scan units of resource folders
+        to a snapshot for import_index on another machine. Folders are stored relative
+        to root, which defaults to their common path, the folder itself when there is
+        only one; the store is machine local and left out by default.
+        Returns the number of mods exported."""
+        from h2mm.snapshot import write_snapshot
+
+        if paths is None:
+            paths = [
+                resource["path"]
+                for resource in self.cfg.resources
+                if resource["path"] != self.store.mods
+            ]
+        paths = [self.__resource_path(path) for path in paths]
+        if not paths:
+            raise RuntimeError("No resource folder to export")
+        root = os.path.abspath(root) if root else os.path.commonpath(paths)
+
+        groups = {}
+        hashes = set()
+        for path in paths:
+            group = path.replace("\\", "/")
+            refs = [
+                [hash, pathref.path, pathref.subpath]
+                for relpath in self.mod_res_index.paths(group)
+                for hash, pathref in self.mod_res_index.at(group, relpath)
+            ]
+            hashes.update(hash for hash, _, _ in refs)
+            groups[os.path.relpath(path, root).replace("\\", "/")] = {
+                "units": self.tree_index.get(path, {}),
+                "refs": refs,
+            }
+        manifests = {
+            hash: self.manifest_index.manifest(hash)
+            for hash in hashes
+            if hash in self.manifest_index
+        }
+        parts = {hash: self.part_index[hash] for hash in hashes if hash in self.part_index}
+        write_snapshot(out, groups, manifests, parts)
+        return len(hashes)
+
+    def import_index(
+        self, snapshot: str, root: str, fast: typing.Optional[bool] = None
+    ) -> dict[str, H2ScanReport]:
+        """Load a snapshot from export_index for the resource folders found under root,
+        adding them to the config if needed. Units whose size and mtime still match the
+        snapshot are trusted without hashing, the rescan that follows only hashes the rest.
+        Returns the scan report of each imported folder."""
+        from h2mm.snapshot import read_snapshot
+
+        data = read_snapshot(snapshot)
+        root = os.path.abspath(root)
+        # a snapshot may come from anywhere, it only names folders under root
+        for relgroup in data["groups"]:
+            path = os.path.normpath(os.path.join(root, relgroup))
+            if os.path.isabs(relgroup) or os.path.commonpath([root, path]) != root:
+                raise RuntimeError(
+                    f"Index snapshot {snapshot} has a resource folder outside {root}: {relgroup}"
+                )
+        # loaded first, so the folders added below are not seen as stale and rebuilt
+        self.tree_index
+        self.mod_res_index
+
+        paths = []
+        for relgroup, group in data["groups"].items():
+            path = os.path.normpath(os.path.join(root, relgroup))
+            if not os.path.isdir(path):
+                logging.warning(f"Resource folder not found, skipping: {path}")
+                continue
+            if not any(resource["path"] == path for resource in self.cfg.resources):
+                self.cfg.resources.append({"path": path, "last_modified": 0})
+
+            self.__drop_refs(path)
+            self.__set_units(path, group["units"])
+            for hash, relpath, subpath in group["refs"]:
+                # the local manifest of a mod wins over the imported one
+                if hash not in self.manifest_index and data["manifests"].get(hash):
+                    self.__set_manifest(hash, data["manifests"][hash])
+                if hash not in self.part_index and hash in data["parts"]:
+                    self.__set_part(hash, data["parts"][hash])
+                self.__add_ref(hash, H2PathRef(path, relpath, subpath))
+            paths.append(path)
+
+        self.__save_mod_resource()
+        if not paths:
+            return {}
+        return self.reparse_resource_folders(paths, fast=fast)
+
+    def reparse_resource_folder(
+        self, path: str | int, jobs: int = 1, fast: typing.Optional[bool] = None
+    ) -> H2ScanReport:
+        """Rescan a resource folder, hashing only the folders and archives that were added
+        or changed since the last scan and dropping the ones that were removed.
+        jobs > 1 hashes in that many worker processes, 0 uses one per CPU.
+        fast identifies zips by their central directory, defaulting to cfg.fast_identity."""
+        events = self.scan_resource_folder(path, jobs, fast)
+        while True:
+            try:
+                event = next(events)
+            except StopIteration as stop:
+                return stop.value
+            if event.kind == "error":
+                logging.warning(event.message)
+
+    def scan_resource_folder(
+        self, path: str | int, jobs: int = 1, fast: typing.Optional[bool] = None
+    ) -> typing.Generator[H2ScanEvent, None, H2ScanReport]:
+        """reparse_resource_folder as a stream of H2ScanEvent, returning the report.
+        Units are committed along with their refs every SCAN_CHECKPOINT_UNITS units or
+        SCAN_CHECKPOINT_SECONDS, so an interrupted scan resumes from the last checkpoint."""
+        if fast is None:
+            fast = self.cfg.fast_identity
+        if jobs == 0:
+            jobs = os.cpu_count() or 1
+        path = self.__resource_path(path)
+        new_units, units, stale, report, rebuild = self.__plan_scan(path)
+        for relpath in new_units.keys() - dict(units).keys():
+            yield H2ScanEvent("skipped", relpath)
+        bytes_total = 0
+        for relpath, unit in units:
+            bytes_total += unit_size(unit, fast)
+            yield H2ScanEvent("discovered", relpath, bytes_total=unit_size(unit, fast))
+
+        self.__begin_scan(path, stale, rebuild)
+        bytes_done = 0
+        checkpoint = (0, time.monotonic())
+        results = scan_units(path, units, jobs, fast)
+        for count, (relpath, unit) in enumerate(units):
+            if (
+                count - checkpoint[0] >= SCAN_CHECKPOINT_UNITS
+                or time.monotonic() - checkpoint[1] > SCAN_CHECKPOINT_SECONDS
+            ):
+                self.__checkpoint()
+                checkpoint = (count, time.monotonic())
+
+            yield H2ScanEvent("hashing", relpath, bytes_done, bytes_total)
+            with profiler.span("scan.hash"):
+                _, metas, warning = next(results)
+            bytes_done += unit_size(unit, fast)
+            yield from self.__apply_unit(
+                path, relpath, unit, metas, warning, bytes_done, bytes_total
+            )
+
+        self.__finish_scan([path])
+        return report
+
+    def reparse_resource_folders(
+        self,
+        paths: typing.Optional[typing.List[str]] = None,
+        per_device: typing.Optional[int] = None,
+        fast: typing.Optional[bool] = None,
+        jobs: int = 1,
+        progress: typing.Optional[typing.Callable[[str, H2ScanEvent], None]] = None,
+    ) -> dict[str, H2ScanReport]:
+        """Rescan several resource folders at once, all of them by default.
+        Folders on different devices are walked and hashed concurrently,
+        with at most per_device units in flight per device.
+        progress is called with the folder and every H2ScanEvent of its scan,
+        errors are logged instead when it is not given."""
+        import asyncio
+
+        if paths is None:
+            paths = [resource["path"] for resource in self.cfg.resources]
+        # loading may rescan stale folders through here, which cannot happen inside the loop
+        self.tree_index
+        self.mod_res_index
+        return asyncio.run(
+            self.scan_resource_folders(paths, per_device, fast, jobs, progress)
+        )
+
+    async def scan_resource_folders(
+        self,
+        paths: typing.List[str],
+        per_device: typing.Optional[int] = None,
+        fast: typing.Optional[bool] = None,
+        jobs: int = 1,
+        progress: typing.Optional[typing.Callable[[str, H2ScanEvent], None]] = None,
+    ) -> dict[str, H2ScanReport]:
+        """Coroutine behind reparse_resource_folders.
+        Walks and hashing run in a thread pool, hashlib and file reads release the GIL,
+        while the indexes are only updated from the event loop, one unit at a time.
+        With jobs > 1, or 0 for one per CPU, units are hashed in a process pool instead."""
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+
+        if fast is None:
+            fast = self.cfg.fast_identity
+        if per_device is None:
+            per_device = self.cfg.scan_per_device
+        if jobs == 0:
+            jobs = os.cpu_count() or 1
+        paths = [self.__resource_path(path) for path in paths]
+        # the indexes are loaded before any thread can touch them
+        self.tree_index
+        self.mod_res_index
+
+        loop = asyncio.get_running_loop()
+        devices = {os.stat(path).st_dev for path in paths}
+        limits = {device: asyncio.Semaphore(per_device) for device in devices}
+        checkpoint = time.monotonic()
+
+        async def scan_unit_limited(executor, limit, path, relpath, unit):
+            async with limit:
+                if hashers is None:
+                    return await loop.run_in_executor(
+                        executor, scan_unit, path, relpath, unit, fast
+                    )
+                metas, warning, entries = await loop.run_in_executor(
+                    hashers, scan_unit_worker, path, relpath, unit, fast
+                )
+                fingerprint_cache.merge(entries)
+                return metas, warning
+
+        async def scan(executor, path):
+            nonlocal checkpoint
+            limit = limits[os.stat(path).st_dev]
+            async with limit:
+                new_units, units, stale, report, rebuild = await loop.run_in_executor(
+                    executor, self.__plan_scan, path
+                )
+            self.__begin_scan(path, stale, rebuild)
+            bytes_total = sum(unit_size(unit, fast) for _, unit in units)
+            if progress is not None:
+                for relpath, unit in units:
+                    progress(path, H2ScanEvent(
+                        "discovered", relpath, bytes_total=unit_size(unit, fast)
+                    ))
+
+            bytes_done = 0
+            tasks = [
+                asyncio.ensure_future(
+                    scan_unit_limited(executor, limit, path, relpath, unit)
+                )
+                for relpath, unit in units
+            ]
+            for (relpath, unit), task in zip(units, tasks):
+                metas, warning = await task
+                bytes_done += unit_size(unit, fast)
+                for event in self.__apply_unit(
+                    path, relpath, unit, metas, warning, bytes_done, bytes_total
+                ):
+                    if progress is not None:
+                        progress(path, event)
+                    elif event.kind == "error":
+                        logging.warning(event.message)
+                if time.monotonic() - checkpoint > SCAN_CHECKPOINT_SECONDS:
+                    self.__checkpoint()
+                    checkpoint = time.monotonic()
+            return report
+
+        hashers = scan_process_pool(jobs) if jobs > 1 else None
+        try:
+            with ThreadPoolExecutor(max_workers=per_device * len(devices)) as executor:
+                reports = await asyncio.gather(*(scan(executor, path) for path in paths))
+        finally:
+            if hashers is not None:
+                hashers.shutdown()
+
+        self.__finish_scan(paths)
+        return dict(zip(paths, reports))
+
+    def __resource_path(self, path: str | int):
         if isinstance(path, int):
             path = self.cfg.resources[path]["path"]
         path = os.path.abspath(path)
@@ -206,50 +651,392 @@ class H2MM:
         assert any(
             resource["path"] == path for resource in self.cfg.resources
         ), f"Resource folder {path} not in config"
+        return path
 
-        
-
-        # get resource
-        resource: H2ModRes = next(
-            resource for resource in self.cfg.resources if resource["path"] == path
+    def __plan_scan(self, path: str):
+        """Walk a resource folder and diff it against the last scan, without changing
+        any index. Returns (new units, units to hash, stale units, report, rebuild)."""
+        # without a tree manifest from a previous scan, rebuild the whole group
+        rebuild = path not in self.tree_index
+        # taken before the walk, so changes made while scanning trigger the next one
+        self.__scan_mtimes[path] = os.path.getmtime(path)
+        old_units = {} if rebuild else self.tree_index[path]
+        report = H2ScanReport()
+        new_units = dict(
+            walk_resource_units(
+                path,
+                jobs=self.cfg.walk_jobs,
+                max_depth=self.cfg.scan_max_depth,
+                stats=report.walk,
+            )
         )
-        resource["last_modified"] = os.path.getmtime(path)
 
-        self.prune_resource_folder(resource["path"])
+        stale = set()
+        units = []
+        for relpath, unit in new_units.items():
+            if old_units.get(relpath) == unit:
+                report.unchanged += 1
+                continue
+            if relpath in old_units:
+                report.changed += 1
+                stale.add(relpath)
+            else:
+                report.added += 1
+            units.append((relpath, unit))
+        for relpath in old_units.keys() - new_units.keys():
+            report.removed += 1
+            stale.add(relpath)
+        return new_units, units, stale, report, rebuild
 
-        # get all eligible pairs
-        eligibles = get_all_eligible_pairs(path)
+    def __begin_scan(self, path: str, stale: typing.Set[str], rebuild: bool):
+        # dropped without saving, the config only records the scan in __finish_scan
+        self.__drop_refs(path, None if rebuild else stale)
+        if rebuild:
+            self.__set_units(path, None)
+        self.tree_index.setdefault(path, {})
+        for relpath in stale:
+            self.__set_unit(path, relpath, None)
 
-        # add to manifest
-        for pair in eligibles:
-            try:
-                hash, pathref, manifest = smart_get_meta(pair, resourceGroup=resource["path"])
-            except zipfile.BadZipFile:
-                logging.warning(f"Bad zip file: {pair[0]}")
-                continue
-            except rarfile.BadRarFile:
-                logging.warning(f"Bad rar file: {pair[0]}")
-                continue
-            except rarfile.PasswordRequired:
-                logging.warning(f"Password required for {pair[0]}")
-                continue
-            except Exception as e:
-                raise e
-            if hash in self.manifest_index:
-                raise RuntimeError(
-                    f"Mod hash conflict: {hash}, {pair[0]} with {self.manifest_index[hash]}"
+    def __apply_unit(
+        self,
+        path: str,
+        relpath: str,
+        unit: list,
+        metas: list,
+        warning: typing.Optional[str],
+        bytes_done: int = 0,
+        bytes_total: int = 0,
+    ):
+        """Index the mods hashed from a unit and record the unit, yielding their events.
+        A unit with a conflicting mod is not recorded, so the next scan tries it again."""
+        if warning is not None:
+            # unreadable as it is, recorded so it is not read again until it changes
+            self.__set_unit(path, relpath, unit)
+            yield H2ScanEvent("error", relpath, bytes_done, bytes_total, message=warning)
+            yield H2ScanEvent("scanned", relpath, bytes_done, bytes_total)
+            return
+
+        indexed = True
+        for hash, pathref, manifest in metas:
+            if is_fast_id(hash) and hash in self.mod_res_index:
+                # two sources share a fast fingerprint, settle it with full hashes
+                self.__resolve_fast_id(hash)
+                hash, _ = generate_zip_meta(os.path.join(path, pathref.path), pathref.subpath)
+            conflict = self.__index_meta(hash, pathref, manifest, relpath)
+            if conflict is not None:
+                indexed = False
+                yield H2ScanEvent(
+                    "error", relpath, bytes_done, bytes_total, hash=hash, message=conflict
                 )
+                continue
+            yield H2ScanEvent("indexed", relpath, bytes_done, bytes_total, hash=hash)
+        if indexed:
+            self.__set_unit(path, relpath, unit)
+        yield H2ScanEvent("scanned", relpath, bytes_done, bytes_total)
+
+    def __checkpoint(self):
+        with profiler.span("index.checkpoint"):
+            self.db.commit()
+            fingerprint_cache.save()
+
+    def __finish_scan(self, paths: typing.List[str]):
+        for resource in self.cfg.resources:
+            if resource["path"] in paths:
+                resource["last_modified"] = self.__scan_mtimes.pop(resource["path"])
+        if self.__match_installed():
+            self.__save_install_index()
+        self.__save_mod_resource()
+
+    def __index_meta(
+        self, hash: str, pathref: H2PathRef, manifest, source: str
+    ) -> typing.Optional[str]:
+        """Index a mod found at pathref, returns why it was not if its manifest conflicts."""
+        with profiler.span("index.update"):
+            # the same mod in several places is fine, as long as they agree on the manifest;
+            # a copy without one, such as a stored one, agrees with any
+            if (
+                manifest is not None
+                and hash in self.manifest_index
+                and manifest != self.manifest_index.manifest(hash)
+            ):
+                name = self.manifest_index[hash].name
+                return f"Mod hash conflict: {hash}, {source} with {name}"
 
             if manifest:
-                self.manifest_index[hash] = manifest
+                self.__set_manifest(hash, manifest)
 
-            if hash not in self.mod_res_index:
-                self.mod_res_index[hash] = []
+            if self.mod_res_index.find(pathref) != hash:
+                self.__add_ref(hash, pathref)
 
-            if pathref not in self.mod_res_index[hash]:
-                self.mod_res_index[hash].append(pathref)
+            if hash not in self.part_index:
+                self.__set_part(hash, get_part_sample(hash, pathref))
 
-        self.__save_mod_resource()
+    def __resolve_fast_id(self, fast_id: str):
+        """Replace a fast zip fingerprint by the sha256 of each source it stands for."""
+        pathrefs = list(self.mod_res_index[fast_id])
+        manifest = self.manifest_index.manifest(fast_id)
+        for pathref in pathrefs:
+            self.__remove_ref(fast_id, pathref)
+        for pathref in pathrefs:
+            hash, _ = generate_zip_meta(
+                os.path.join(pathref.resourceGroup, pathref.path), pathref.subpath
+            )
+            conflict = self.__index_meta(hash, pathref, manifest, pathref.path)
+            if conflict is not None:
+                logging.warning(conflict)
+
+    def __match_installed(self):
+        """Bring mod_res_index and mod_install_index together after either changed.
+        Fast fingerprints whose part sizes match an installed patch are resolved to their
+        sha256, and installed patches keyed by sample_id are identified again if a library
+        mod now has their part sizes. Returns whether anything changed."""
+        if not self.mod_install_index or not self.mod_res_index:
+            return False
+
+        data_path = os.path.join(self.cfg.game_path, "data")
+        changed = False
+
+        fast_ids = [hash for hash in self.mod_res_index if is_fast_id(hash)]
+        if fast_ids:
+            installed_sizes = {
+                triple_sizes(data_path, file) for file in self.mod_install_index.values()
+            }
+            for fast_id in fast_ids:
+                if fast_id_sizes(fast_id) in installed_sizes:
+                    self.__resolve_fast_id(fast_id)
+                    changed = True
+
+        unmatched = [hash for hash in self.mod_install_index if is_sample_id(hash)]
+        if unmatched:
+            by_sizes = self.__parts_by_sizes()
+            for hash in unmatched:
+                file = self.mod_install_index[hash]
+                if triple_sizes(data_path, file) not in by_sizes:
+                    continue
+                new_hash = self.__identify_installed(data_path, file, by_sizes)
+                if new_hash != hash:
+                    self.__set_install(hash, None)
+                    self.__set_install(new_hash, file)
+                    changed = True
+
+        return changed
+
+    def __add_ref(self, hash: str, pathref: H2PathRef):
+        self.mod_res_index.add(hash, pathref)
+        self.db.add_ref(hash, pathref)
+
+    def __remove_ref(self, hash: str, pathref: H2PathRef):
+        """Remove one ref, forgetting the hash once it has none left."""
+        self.db.remove_ref(hash, pathref)
+        if not self.mod_res_index.remove(hash, pathref):
+            self.__forget(hash)
+
+    def __forget(self, hash: str):
+        """Drop the manifest and parts of a hash whose refs are all gone."""
+        if self.manifest_index.pop(hash) is not None:
+            self.db.set_manifest(hash, None)
+        if self.part_index.pop(hash, None) is not None:
+            self.db.set_part(hash, None)
+
+    def __set_manifest(self, hash: str, manifest):
+        self.manifest_index.set(hash, manifest)
+        self.db.set_manifest(hash, manifest)
+
+    def __set_part(self, hash: str, part: list):
+        self.part_index[hash] = part
+        self.db.set_part(hash, part)
+
+    def __set_install(self, hash: str, file: typing.Optional[str]):
+        if file is None:
+            self.mod_install_index.pop(hash, None)
+        else:
+            self.mod_install_index[hash] = file
+        self.db.set_install(hash, file)
+
+    def __set_unit(self, path: str, relpath: str, unit: typing.Optional[list]):
+        if unit is None:
+            self.tree_index[path].pop(relpath, None)
+        else:
+            self.tree_index[path][relpath] = unit
+        self.db.set_unit(path, relpath, unit)
+
+    def __set_units(self, path: str, units: typing.Optional[dict[str, list]]):
+        self.db.set_units(path, units, self.tree_index.get(path, {}))
+        if units is None:
+            self.tree_index.pop(path, None)
+        else:
+            self.tree_index[path] = units
+
+    def find_mod(self, query: str) -> str:
+        """Resolve a hash, a unique hash prefix, or a mod name to the hash of an indexed mod."""
+        if query in self.mod_res_index:
+            return query
+        matches = [hash for hash in self.mod_res_index if hash.startswith(query)]
+        if not matches:
+            matches = [
+                hash
+                for hash, pathrefs in self.mod_res_index.items()
+                if hash in self.manifest_index and self.manifest_index[hash].name == query
+                or any(self.__ref_name(pathref) == query for pathref in pathrefs)
+            ]
+        if len(matches) != 1:
+            raise RuntimeError(
+                f"{len(matches)} mods match {query}"
+                + (f": {', '.join(matches)}" if matches else "")
+            )
+        return matches[0]
+
+    def __ref_name(self, pathref: H2PathRef) -> str:
+        # stored mods are folders named by their hash, they go by the name of their source
+        if pathref.resourceGroup == self.store.mods.replace("\\", "/"):
+            return self.store.name(pathref.name) or pathref.name
+        return pathref.name
+
+    def install_mod(self, query: str):
+        """Install an indexed mod into the game data folder under the next free patch_N.
+        The hash is already known, so mod_install_index is updated without hashing the files.
+        Returns the installed file name and the copy method used per part."""
+        hash = self.find_mod(query)
+        if is_fast_id(hash):
+            # installs are keyed by sha256, so the source is hashed once here
+            pathref = self.mod_res_index[hash][0]
+            self.__resolve_fast_id(hash)
+            hash = self.mod_res_index.find(pathref)
+            self.__save_mod_resource()
+        if hash in self.mod_install_index:
+            raise RuntimeError(
+                f"Mod {query} is already installed as {self.mod_install_index[hash]}"
+            )
+
+        data_path = os.path.join(self.cfg.game_path, "data")
+        installed, methods = install_parts(self.__install_source(hash), data_path)
+        calculate_hash.store(hash, data_path, installed)
+
+        self.__set_install(hash, installed)
+        self.__save_install_index()
+        return installed, methods
+
+    def installed_state(self) -> InstallState:
+        """hash -> the patch files every installed mod has in the data folder, target first."""
+        files = set(os.listdir(os.path.join(self.cfg.game_path, "data")))
+        return {
+            hash: [
+                file + suffix
+                for suffix in ("", ".gpu_resources", ".stream")
+                if file + suffix in files
+            ]
+            for hash, file in self.mod_install_index.items()
+        }
+
+    def save_profile(self, name: str):
+        """Record the installed patch files as a profile, returns the number of mods in it."""
+        state = self.installed_state()
+        self.profiles.save(name, state)
+        return len(state)
+
+    def apply_profile(self, name: str):
+        """Switch the data folder to the mods of a profile, all or nothing.
+        The previous patch files are kept as a snapshot for rollback_profile."""
+        wanted = self.profiles.load(name)
+        self.profiles.switch(self.installed_state(), wanted, self.__stage_mod)
+        self.__set_installs(wanted)
+        self.profiles.finish(self.cfg.profile_snapshots)
+        return len(wanted)
+
+    def rollback_profile(self):
+        """Restore the patch files from before the last profile switch."""
+        state = self.profiles.rollback(self.installed_state())
+        self.__set_installs(state)
+        self.profiles.drop_latest()
+        return len(state)
+
+    def __stage_mod(self, hash: str, path: str, target: str):
+        if hash not in self.mod_res_index:
+            raise RuntimeError(
+                f"Mod {hash} of the profile is not installed, in a snapshot or in the library"
+            )
+        install_parts(self.__install_source(hash), path, installed=target)
+
+    def __set_installs(self, state: InstallState):
+        """Replace mod_install_index with the mods of a state that is now in the data folder."""
+        data_path = os.path.join(self.cfg.game_path, "data")
+        for hash in [hash for hash in self.mod_install_index if hash not in state]:
+            self.__set_install(hash, None)
+        for hash, files in state.items():
+            if self.mod_install_index.get(hash) != files[0]:
+                self.__set_install(hash, files[0])
+                if not is_sample_id(hash):
+                    calculate_hash.store(hash, data_path, files[0])
+        self.__save_install_index()
+
+    def plan_install(self, queries: typing.Iterable[str], with_installed: bool = False):
+        """Conflict graph and patch_N order of a set of mods, read from their manifests.
+        with_installed adds the installed mods to the set. Mods without a manifest
+        have no overwrites and the default priority."""
+        hashes = [self.find_mod(query) for query in queries]
+        if with_installed:
+            hashes += [hash for hash in self.mod_install_index if hash not in hashes]
+        plan = H2InstallPlan()
+        for hash in hashes:
+            mod = self.manifest_index.get(hash)
+            if mod is None:
+                pathrefs = self.mod_res_index.get(hash)
+                mod = H2Mod(
+                    name=self.__ref_name(pathrefs[0]) if pathrefs else hash, description=""
+                )
+            plan.add(hash, mod, self.mod_target(hash))
+        return plan
+
+    def mod_target(self, hash: str) -> str:
+        """The game archive a mod patches, from its installed file or its source."""
+        file = self.mod_install_index.get(hash)
+        if file is None:
+            file = source_parts(self.mod_res_index[hash][0])[0]
+        match = PATCH_RE.match(file)
+        return match.group("base") if match else file
+
+    def __install_source(self, hash: str) -> H2PathRef:
+        # prefer the stored copy, installing it links the store instead of copying
+        pathrefs = self.mod_res_index[hash]
+        store_group = self.store.mods.replace("\\", "/")
+        return next(
+            (pathref for pathref in pathrefs if pathref.resourceGroup == store_group),
+            pathrefs[0],
+        )
+
+    def which(self, path: str) -> typing.List[typing.Tuple[str, H2PathRef]]:
+        """The mods indexed from a file or folder of a resource folder, as (hash, ref) pairs.
+        An archive gives one pair per mod folder in it."""
+        path = os.path.abspath(path).replace("\\", "/")
+        found = []
+        for group in self.mod_res_index.groups:
+            if path == group:
+                found += self.mod_res_index.at(group, ".")
+            elif path.startswith(group + "/"):
+                found += self.mod_res_index.at(group, path[len(group) + 1 :])
+        return found
+
+    def lookup(self, hash: str):
+        """Everything known about a hash: where it is in the library, its manifest
+        and the patch file it is installed as."""
+        return {
+            "hash": hash,
+            "refs": [asdict(pathref) for pathref in self.mod_res_index.get(hash, [])],
+            "manifest": self.manifest_index.manifest(hash),
+            "installed_file": self.mod_install_index.get(hash),
+            "conflicts": self.conflicting_mods(hash),
+        }
+
+    def conflicting_mods(self, hash: str) -> dict[str, typing.List[str]]:
+        """asset -> the other indexed mods that overwrite it too, from the conflict index."""
+        if hash not in self.manifest_index:
+            return {}
+        assets = self.manifest_index.assets()
+        return {
+            asset: sorted(assets[asset] - {hash})
+            for asset in self.manifest_index[hash].conflicting_overwrites
+            if len(assets[asset]) > 1
+        }
 
     def list_installed_mods(self):
         table = []
@@ -259,7 +1046,11 @@ class H2MM:
                 name = manifest.name
                 description = manifest.description
             else:
-                name = self.mod_res_index[hash][0].name if hash in self.mod_res_index else "Unknown"
+                name = (
+                    self.__ref_name(self.mod_res_index[hash][0])
+                    if hash in self.mod_res_index
+                    else "Unknown"
+                )
                 description = "N/A"
             
             table.append(
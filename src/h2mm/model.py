@@ -1,8 +1,8 @@
 from dataclasses import asdict, dataclass, field
 from datetime import datetime
+import logging
 import os
 import typing
-import toml
 
 
 @dataclass(slots=True)
@@ -16,15 +16,122 @@ class H2PathRef:
         self.path = self.path.replace("\\", "/")
         self.subpath = self.subpath.replace("\\", "/")
 
+    @classmethod
+    def normalized(cls, resourceGroup: str, path: str, subpath: str):
+        """Build a ref from strings that are already normalized, skipping __post_init__."""
+        pathref = object.__new__(cls)
+        pathref.resourceGroup = resourceGroup
+        pathref.path = path
+        pathref.subpath = subpath
+        return pathref
+
     @property
     def name(self):
         return os.path.splitext(os.path.basename(self.path))[0]
 
 
+def _as_str(value) -> str:
+    if not isinstance(value, str):
+        raise TypeError(value)
+    return value
+
+
+def _as_keys(value) -> typing.Tuple[str, ...]:
+    # a lone asset key is written as a string instead of a list of one
+    if isinstance(value, str):
+        return (value,)
+    if not isinstance(value, (list, tuple)) or not all(isinstance(key, str) for key in value):
+        raise TypeError(value)
+    return tuple(value)
+
+
+def _as_bool(value) -> bool:
+    if not isinstance(value, (bool, int)):
+        raise TypeError(value)
+    return bool(value)
+
+
+def _as_int(value) -> int:
+    # bool is an int, but true is no priority
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise TypeError(value)
+    return int(value)
+
+
 @dataclass(slots=True)
 class H2Mod:
     name : str
     description : str
+    # asset keys the mod replaces, and those it replaces without caring who wins
+    overwrites: typing.Tuple[str, ...] = ()
+    ignorable_overwrites: typing.Tuple[str, ...] = ()
+    # replaces the base archive itself, so it goes below every other patch
+    replace_base: bool = False
+    # among mods overwriting the same asset, the highest priority gets the highest patch_N
+    patch_num_priority: int = 0
+
+    @classmethod
+    def from_manifest(cls, manifest: dict):
+        """Read a mod manifest, falling back to the default of any field of the wrong type."""
+        if not isinstance(manifest, dict):
+            logging.warning(f"Ignoring a manifest that is not an object: {manifest!r}")
+            manifest = {}
+
+        # mod manifests are written with either capitalized or lowercase keys
+        def get(key: str, default, coerce):
+            value = manifest.get(key, manifest.get(key[0].upper() + key[1:], default))
+            if value is default:
+                return default
+            try:
+                return coerce(value)
+            except (TypeError, ValueError, OverflowError):
+                name = manifest.get("name", manifest.get("Name"))
+                logging.warning(f"Ignoring {key} in the manifest of {name}: {value!r}")
+                return default
+
+        return cls(
+            name=get("name", "", _as_str),
+            description=get("description", "", _as_str),
+            overwrites=get("overwrites", (), _as_keys),
+            ignorable_overwrites=get("ignorable-overwrites", (), _as_keys),
+            replace_base=get("replaceBase", False, _as_bool),
+            patch_num_priority=get("patchNumPriority", 0, _as_int),
+        )
+
+    @property
+    def conflicting_overwrites(self):
+        ignorable = set(self.ignorable_overwrites)
+        return [asset for asset in self.overwrites if asset not in ignorable]
+
+
+@dataclass(slots=True)
+class H2WalkStats:
+    folders: int = 0
+    files: int = 0
+    stat_calls: int = 0
+    seconds: float = 0.0
+
+
+@dataclass(slots=True)
+class H2ScanReport:
+    added: int = 0
+    removed: int = 0
+    changed: int = 0
+    unchanged: int = 0
+    walk: H2WalkStats = field(default_factory=H2WalkStats)
+
+
+@dataclass(slots=True)
+class H2ScanEvent:
+    """Progress of a scan: a unit is skipped, or discovered and then hashing,
+    followed by indexed once per mod in it or by error, and scanned once it is done.
+    bytes_done and bytes_total count the bytes hashed so far and in all, per folder."""
+    kind: str
+    relpath: str
+    bytes_done: int = 0
+    bytes_total: int = 0
+    hash: str | None = None
+    message: str | None = None
 
 
 class H2ModRes(typing.TypedDict):
@@ -37,8 +144,19 @@ class H2MMCfg:
     game_path: str
     resources: typing.List[H2ModRes] = field(default_factory=list)
     last_install_check: float = field(
-        default_factory=lambda: int(datetime.datetime.now().timestamp())
+        default_factory=lambda: int(datetime.now().timestamp())
     )
+    fingerprint_cache_size: int = 50000
+    fast_identity: bool = False
+    # units hashed at once per disk when several resource folders are scanned together
+    scan_per_device: int = 2
+    # threads listing the folders of a resource folder, and how deep to look, 0 for no limit
+    walk_jobs: int = 4
+    scan_max_depth: int = 0
+    # bytes read at a time when hashing, archive members of 4 chunks or more are read ahead
+    hash_chunk_size: int = 1024 * 1024
+    # hardlinked snapshots of the data folder kept for profile rollbacks
+    profile_snapshots: int = 5
 
     @classmethod
     def exists(cls, cfgPath: typing.Optional[str] = None):
@@ -64,7 +182,10 @@ class H2MMCfg:
         if ignoreExists and os.path.exists(cfgPath):
             return
 
+        import toml
+
+        from h2mm.etc import atomic_write
+
         cfg = H2MMCfg(game_path=game_path, resources=resources)
-        with open(cfgPath, "w", encoding="utf-8") as f:
-            toml.dump(asdict(cfg), f)
+        atomic_write(cfgPath, toml.dumps(asdict(cfg)))
         return cfg
@@ -0,0 +1,109 @@
+import contextlib
+import json
+import os
+import threading
+import time
+import typing
+
+# handed out by disabled profilers, nullcontext can be entered any number of times
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class Profiler:
+    """Named timing spans and counters for the hot paths, off unless enabled.
+    A disabled span or counter costs a flag check. Spans nest, so a stage includes
+    the time of the stages it calls. Work done in scan worker processes is not seen."""
+
+    def __init__(self):
+        self.enabled = False
+        self.tracing = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.start = time.perf_counter()
+        # name -> [calls, seconds]
+        self.spans: dict[str, list] = {}
+        self.counters: dict[str, int] = {}
+        # name -> [bytes, seconds] of the sources read by the hashing engine
+        self.rates: dict[str, list] = {}
+        # (name, start, duration, thread) of every span, kept for the chrome trace
+        self.events: typing.List[typing.Tuple[str, float, float, int]] = []
+
+    def enable(self, trace: bool = False):
+        self.reset()
+        self.enabled = True
+        self.tracing = trace
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name: str) -> typing.ContextManager:
+        if not self.enabled:
+            return _NULL_SPAN
+        return self.__span(name)
+
+    @contextlib.contextmanager
+    def __span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self.lock:
+                entry = self.spans.setdefault(name, [0, 0.0])
+                entry[0] += 1
+                entry[1] += duration
+                if self.tracing:
+                    self.events.append((name, start, duration, threading.get_ident()))
+
+    def count(self, name: str, n: int = 1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def rate(self, name: str, size: int, seconds: float):
+        if not self.enabled:
+            return
+        with self.lock:
+            entry = self.rates.setdefault(name, [0, 0.0])
+            entry[0] += size
+            entry[1] += seconds
+
+    def report(self):
+        """Stages by total time, the counters, then the throughput per source, as a table."""
+        wall = time.perf_counter() - self.start
+        lines = [f"{'stage':<24} {'calls':>8} {'seconds':>9} {'of wall':>8}"]
+        for name, (calls, seconds) in sorted(self.spans.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:<24} {calls:>8} {seconds:>9.3f} {seconds / wall:>8.1%}")
+        lines.append(f"{'wall':<24} {'':>8} {wall:>9.3f}")
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name:<24} {value:>18,}")
+        for name, (size, seconds) in sorted(self.rates.items()):
+            speed = size / 2**20 / seconds if seconds else 0.0
+            lines.append(f"{name:<24} {size / 2**20:>9.1f} MB {speed:>8.1f} MB/s")
+        return "\n".join(lines)
+
+    def write_chrome_trace(self, path: str):
+        """Write the spans as complete events of the Chrome trace format,
+        for chrome://tracing or Perfetto, with the counters as metadata."""
+        pid = os.getpid()
+        events = [
+            {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self.start) * 1e6,
+                "dur": duration * 1e6,
+                "pid": pid,
+                "tid": thread,
+            }
+            for name, start, duration, thread in self.events
+        ]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"traceEvents": events, "displayTimeUnit": "ms", "otherData": self.counters}, f
+            )
+
+
+profiler = Profiler()
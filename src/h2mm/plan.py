@@ -0,0 +1,93 @@
+from bisect import insort
+from dataclasses import dataclass
+import typing
+from h2mm.model import H2Mod
+
+
+@dataclass(slots=True)
+class H2PlannedPatch:
+    hash: str
+    name: str
+    # the archive the mod patches and the patch file it gets
+    target: str
+    file: str
+
+
+@dataclass(slots=True)
+class H2Conflict:
+    asset: str
+    # in load order, the last one wins
+    hashes: typing.List[str]
+    # the winner is decided by replaceBase or patchNumPriority within one target,
+    # not by the name tie-break or by the load order of two archives
+    resolved: bool
+
+    @property
+    def winner(self):
+        return self.hashes[-1]
+
+
+def _order_key(hash: str, mod: H2Mod):
+    # base replacements first, then ascending priority, so the highest priority loads last
+    return (not mod.replace_base, mod.patch_num_priority, mod.name.casefold(), hash)
+
+
+class H2InstallPlan:
+    """Conflict graph and patch_N order of a set of mods, planned for one command.
+    Adding a mod only touches its own assets and its target's order, so building it
+    for n mods is O(n log n) plus their assets.
+    The graph is kept as asset -> mods, an edge joins two mods sharing a conflicting asset."""
+
+    def __init__(self):
+        self.mods: dict[str, H2Mod] = {}
+        self.targets: dict[str, str] = {}
+        self.by_asset: dict[str, set[str]] = {}
+        # target -> sorted order keys of its mods
+        self.order: dict[str, list] = {}
+        # assets overwritten by more than one mod of the set
+        self.conflicted: typing.Set[str] = set()
+
+    def __contains__(self, hash: object):
+        return hash in self.mods
+
+    def __len__(self):
+        return len(self.mods)
+
+    def add(self, hash: str, mod: H2Mod, target: str):
+        if hash in self.mods:
+            return
+        self.mods[hash] = mod
+        self.targets[hash] = target
+        insort(self.order.setdefault(target, []), _order_key(hash, mod))
+        for asset in mod.conflicting_overwrites:
+            hashes = self.by_asset.setdefault(asset, set())
+            hashes.add(hash)
+            if len(hashes) > 1:
+                self.conflicted.add(asset)
+
+    def neighbours(self, hash: str) -> typing.Set[str]:
+        """The mods of the set that overwrite one of the assets of hash."""
+        found = set()
+        for asset in self.mods[hash].conflicting_overwrites:
+            found |= self.by_asset[asset]
+        found.discard(hash)
+        return found
+
+    def patches(self) -> typing.List[H2PlannedPatch]:
+        """Every mod with the patch file it gets, numbered from patch_0 per target."""
+        return [
+            H2PlannedPatch(key[3], self.mods[key[3]].name, target, f"{target}.patch_{num}")
+            for target in sorted(self.order)
+            for num, key in enumerate(self.order[target])
+        ]
+
+    def conflicts(self) -> typing.List[H2Conflict]:
+        found = []
+        for asset in sorted(self.conflicted):
+            keys = sorted(_order_key(hash, self.mods[hash]) for hash in self.by_asset[asset])
+            hashes = [key[3] for key in keys]
+            resolved = keys[-1][:2] > keys[-2][:2] and len(
+                {self.targets[hash] for hash in hashes}
+            ) == 1
+            found.append(H2Conflict(asset, hashes, resolved))
+        return found
@@ -0,0 +1,232 @@
+import json
+import os
+import shutil
+import time
+import typing
+from h2mm.etc import atomic_write
+
+PROFILE_FORMAT = "h2mm-profile"
+PROFILE_VERSION = 1
+# the target is moved last, so a triple is never picked up as a patch without its parts
+PART_SUFFIXES = (".gpu_resources", ".stream", "")
+
+# hash -> the patch files it is installed as in the data folder, target first
+InstallState = dict[str, typing.List[str]]
+
+
+def _parts_first(files: typing.Iterable[str]):
+    return sorted(files, key=lambda file: PART_SUFFIXES.index(_suffix(file)))
+
+
+def _suffix(file: str):
+    return next(suffix for suffix in PART_SUFFIXES if file.endswith(suffix))
+
+
+def _link(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # no hardlinks on this filesystem, keep a copy instead
+        shutil.copy2(src, dst)
+
+
+class H2Profiles:
+    """Saved install sets, and atomic switches between them.
+    A profile is a json file of the patch files every mod of the set is installed as.
+    A switch prepares the new files in a staging folder next to data/ and keeps the
+    current patch files as a hardlinked snapshot before it removes or renames anything;
+    a journal written in between makes an interrupted switch roll back to the snapshot."""
+
+    def __init__(self, root: str, data_path: str):
+        self.root = root
+        self.data_path = data_path
+        # beside data/ so renames stay on one filesystem and snapshots can hardlink
+        work = os.path.join(os.path.dirname(os.path.abspath(data_path)), ".h2mm")
+        self.staging = os.path.join(work, "staging")
+        self.snapshots = os.path.join(work, "snapshots")
+        self.journal = os.path.join(work, "journal.json")
+
+    def profile_path(self, name: str):
+        # names are file names inside root, never paths out of it
+        if not name or ".." in name or any(sep in name for sep in ("/", "\\")):
+            raise RuntimeError(f"Invalid profile name: {name}")
+        return os.path.join(self.root, name + ".json")
+
+    def names(self) -> typing.List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            os.path.splitext(file)[0] for file in os.listdir(self.root) if file.endswith(".json")
+        )
+
+    def save(self, name: str, state: InstallState):
+        os.makedirs(self.root, exist_ok=True)
+        atomic_write(
+            self.profile_path(name),
+            json.dumps(
+                {"format": PROFILE_FORMAT, "version": PROFILE_VERSION, "mods": state},
+                indent=2,
+                sort_keys=True,
+            ),
+        )
+
+    def load(self, name: str) -> InstallState:
+        path = self.profile_path(name)
+        if not os.path.exists(path):
+            raise RuntimeError(f"No profile named {name}")
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("format") != PROFILE_FORMAT or data.get("version", 0) > PROFILE_VERSION:
+            raise RuntimeError(f"{path} is not a profile this version of h2mm can read")
+        return data["mods"]
+
+    def snapshot_ids(self) -> typing.List[str]:
+        if not os.path.isdir(self.snapshots):
+            return []
+        return sorted(name for name in os.listdir(self.snapshots) if not name.endswith(".tmp"))
+
+    def switch(
+        self,
+        current: InstallState,
+        wanted: InstallState,
+        stage: typing.Callable[[str, str, str], None],
+    ):
+        """Make the patch files of the data folder those of wanted, all or nothing.
+        Mods installed under the same files are left alone. The others are linked from
+        the data folder or a snapshot when possible, and otherwise materialized by
+        stage(hash, staging folder, target). Returns the id of the snapshot of current."""
+        kept = {hash for hash, files in wanted.items() if current.get(hash) == files}
+        # where installed copies can be linked from, the newest first
+        sources = [(self.data_path, current)] + [
+            (os.path.join(self.snapshots, snapshot), self.__snapshot_state(snapshot))
+            for snapshot in reversed(self.snapshot_ids())
+        ]
+        shutil.rmtree(self.staging, ignore_errors=True)
+        os.makedirs(self.staging)
+        try:
+            for hash, files in wanted.items():
+                if hash not in kept:
+                    self.__stage(hash, files, sources, stage)
+            snapshot = self.__snapshot(current)
+        except BaseException:
+            shutil.rmtree(self.staging, ignore_errors=True)
+            raise
+
+        touched = [file for hash, files in wanted.items() if hash not in kept for file in files]
+        self.__begin(snapshot, touched)
+        try:
+            for hash, files in current.items():
+                if hash not in kept:
+                    for file in files:
+                        self.__remove(file)
+            for file in _parts_first(touched):
+                os.replace(os.path.join(self.staging, file), os.path.join(self.data_path, file))
+        except BaseException:
+            self.recover()
+            raise
+        return snapshot
+
+    def finish(self, keep: int):
+        """Forget the journal once the switch is recorded, and the oldest snapshots past keep."""
+        if os.path.exists(self.journal):
+            os.remove(self.journal)
+        shutil.rmtree(self.staging, ignore_errors=True)
+        snapshots = self.snapshot_ids()
+        for snapshot in snapshots[: max(0, len(snapshots) - keep)]:
+            shutil.rmtree(os.path.join(self.snapshots, snapshot), ignore_errors=True)
+
+    def rollback(self, current: InstallState) -> InstallState:
+        """Restore the latest snapshot, which is dropped once the restore is recorded."""
+        snapshots = self.snapshot_ids()
+        if not snapshots:
+            raise RuntimeError("No snapshot to roll back to")
+        self.__begin(snapshots[-1], [file for files in current.values() for file in files])
+        return self.__restore(snapshots[-1], current)
+
+    def drop_latest(self):
+        """Finish a rollback: forget the journal and the snapshot it restored."""
+        snapshots = self.snapshot_ids()
+        if os.path.exists(self.journal):
+            os.remove(self.journal)
+        if snapshots:
+            shutil.rmtree(os.path.join(self.snapshots, snapshots[-1]))
+
+    def recover(self) -> typing.Optional[InstallState]:
+        """Roll back a switch or a rollback that was interrupted, returns the restored state."""
+        if not os.path.exists(self.journal):
+            return None
+        with open(self.journal, "r", encoding="utf-8") as f:
+            journal = json.load(f)
+        state = self.__restore(journal["snapshot"], {"": journal["touched"]})
+        os.remove(self.journal)
+        shutil.rmtree(self.staging, ignore_errors=True)
+        return state
+
+    def __begin(self, snapshot: str, touched: typing.List[str]):
+        atomic_write(self.journal, json.dumps({"snapshot": snapshot, "touched": touched}))
+
+    def __stage(
+        self,
+        hash: str,
+        files: typing.List[str],
+        sources: typing.List[typing.Tuple[str, InstallState]],
+        stage: typing.Callable[[str, str, str], None],
+    ):
+        for folder, state in sources:
+            installed = state.get(hash)
+            # a source with the same parts under another patch_N is linked, not copied
+            if installed and sorted(map(_suffix, installed)) == sorted(map(_suffix, files)):
+                for file in files:
+                    _link(
+                        os.path.join(folder, installed[0] + _suffix(file)),
+                        os.path.join(self.staging, file),
+                    )
+                return
+        stage(hash, self.staging, files[0])
+
+    def __snapshot(self, state: InstallState) -> str:
+        snapshot = f"{time.time_ns()}"
+        tmp = os.path.join(self.snapshots, snapshot + ".tmp")
+        os.makedirs(tmp)
+        try:
+            for files in state.values():
+                for file in files:
+                    _link(os.path.join(self.data_path, file), os.path.join(tmp, file))
+            with open(os.path.join(tmp, "state.json"), "w", encoding="utf-8") as f:
+                json.dump(state, f)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        os.replace(tmp, os.path.join(self.snapshots, snapshot))
+        return snapshot
+
+    def __snapshot_state(self, snapshot: str) -> InstallState:
+        with open(os.path.join(self.snapshots, snapshot, "state.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def __restore(self, snapshot: str, current: InstallState) -> InstallState:
+        """Make the patch files of the data folder those of a snapshot again.
+        Every step can be repeated, so an interrupted restore is finished by the next one."""
+        state = self.__snapshot_state(snapshot)
+        wanted = {file for files in state.values() for file in files}
+        for files in current.values():
+            for file in files:
+                if file not in wanted:
+                    self.__remove(file)
+        folder = os.path.join(self.snapshots, snapshot)
+        for file in _parts_first(wanted):
+            dst = os.path.join(self.data_path, file)
+            src = os.path.join(folder, file)
+            if os.path.exists(dst) and os.path.samefile(src, dst):
+                continue
+            if os.path.exists(dst + ".h2mmtmp"):
+                os.remove(dst + ".h2mmtmp")
+            _link(src, dst + ".h2mmtmp")
+            os.replace(dst + ".h2mmtmp", dst)
+        return state
+
+    def __remove(self, file: str):
+        try:
+            os.remove(os.path.join(self.data_path, file))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,47 @@
+import gzip
+import json
+import os
+import typing
+
+SNAPSHOT_FORMAT = "h2mm-index"
+# bump when the layout of a snapshot changes, older readers refuse newer snapshots
+SNAPSHOT_VERSION = 1
+
+
+def write_snapshot(
+    path: str,
+    groups: dict[str, dict],
+    manifests: dict[str, dict],
+    parts: dict[str, list],
+):
+    """Write an index snapshot as gzipped json.
+    groups maps a resource folder, relative to the root it was exported from, to
+    {"units": {relpath: unit}, "refs": [[hash, path, subpath], ...]}."""
+    data = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "groups": groups,
+        "manifests": manifests,
+        "parts": parts,
+    }
+    tmp = path + ".tmp"
+    # mtime=0 so the same index always exports to the same bytes
+    with open(tmp, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as f:
+        f.write(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode())
+    os.replace(tmp, path)
+
+
+def read_snapshot(path: str) -> dict[str, typing.Any]:
+    try:
+        with gzip.open(path, "rb") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise RuntimeError(f"Not an index snapshot: {path} ({e})")
+    if not isinstance(data, dict) or data.get("format") != SNAPSHOT_FORMAT:
+        raise RuntimeError(f"Not an index snapshot: {path}")
+    if data["version"] > SNAPSHOT_VERSION:
+        raise RuntimeError(
+            f"Index snapshot {path} is version {data['version']}, "
+            f"this h2mm reads up to version {SNAPSHOT_VERSION}"
+        )
+    return data
@@ -0,0 +1,145 @@
+from hashlib import sha256
+import json
+import os
+import shutil
+import tempfile
+import typing
+from h2mm.etc import atomic_write
+from h2mm.hashing import iter_chunks
+from h2mm.install import source_parts
+from h2mm.model import H2PathRef
+from h2mm.utils import open_nested
+
+
+class H2Store:
+    """Content addressed storage for imported mods, under the config directory.
+    objects/ holds every unique patch file once, named by its sha256.
+    mods/<hash> holds the patch files of every unique mod as hardlinks to their objects,
+    and is indexed like any other resource folder.
+    names.json keeps the name of the source of every mod, which its folder does not have."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.objects = os.path.join(root, "objects")
+        self.mods = os.path.join(root, "mods")
+        self.names_path = os.path.join(root, "names.json")
+        self._names: typing.Optional[dict[str, str]] = None
+
+    @property
+    def names(self) -> dict[str, str]:
+        if self._names is None:
+            self._names = {}
+            if os.path.exists(self.names_path):
+                with open(self.names_path, "r", encoding="utf-8") as f:
+                    self._names = json.load(f)
+        return self._names
+
+    def name(self, hash: str) -> typing.Optional[str]:
+        """The name of the folder or archive a stored mod was added from."""
+        return self.names.get(hash)
+
+    def __save_names(self):
+        os.makedirs(self.root, exist_ok=True)
+        atomic_write(
+            self.names_path, json.dumps(self.names, ensure_ascii=False, indent=2, sort_keys=True)
+        )
+
+    def object_path(self, digest: str):
+        return os.path.join(self.objects, digest[:2], digest)
+
+    def mod_path(self, hash: str):
+        return os.path.join(self.mods, hash[:2], hash)
+
+    def __contains__(self, hash: str):
+        return os.path.isdir(self.mod_path(hash))
+
+    def __put(self, f) -> str:
+        """Copy a stream into objects/ while hashing it, keeping the existing object if any."""
+        os.makedirs(self.objects, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.objects, prefix=".", suffix=".h2mmtmp")
+        hasher = sha256()
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter_chunks(f, kind="store"):
+                hasher.update(chunk)
+                out.write(chunk)
+
+        digest = hasher.hexdigest()
+        path = self.object_path(digest)
+        if os.path.exists(path):
+            os.remove(tmp)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+        return digest
+
+    def __link(self, digest: str, dst: str):
+        try:
+            os.link(self.object_path(digest), dst)
+        except OSError:
+            # no hardlinks on this filesystem, the mod keeps its own copy
+            shutil.copyfile(self.object_path(digest), dst)
+
+    def add(self, hash: str, pathref: H2PathRef, manifest: dict | None = None):
+        """Store the patch files of an indexed mod. Returns False if the store already has it."""
+        if hash in self:
+            return False
+
+        mod_path = self.mod_path(hash)
+        # assembled next to its final place and renamed, hidden from scans until then
+        tmp = os.path.join(os.path.dirname(mod_path), "." + hash + ".h2mmtmp")
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+
+        path = os.path.join(pathref.resourceGroup, pathref.path)
+        parts = source_parts(pathref)
+        if os.path.isdir(path):
+            for part in parts:
+                with open(os.path.join(path, part), "rb") as f:
+                    self.__link(self.__put(f), os.path.join(tmp, part))
+        else:
+            with open_nested(path, pathref.subpath) as (archive, folder):
+                for member, f in archive.stream([folder + part for part in parts]):
+                    self.__link(self.__put(f), os.path.join(tmp, member[len(folder) :]))
+
+        if manifest:
+            with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=4)
+
+        os.replace(tmp, mod_path)
+        # the folder itself when a mod folder is added on its own, where pathref.path is "."
+        self.names[hash] = os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+        self.__save_names()
+        return True
+
+    def remove(self, hash: str):
+        """Drop a mod from the store, its objects are reclaimed by gc."""
+        shutil.rmtree(self.mod_path(hash))
+        if self.names.pop(hash, None) is not None:
+            self.__save_names()
+
+    def gc(self):
+        """Delete the objects no stored or installed mod links to anymore, along with
+        leftovers of interrupted imports. Returns (files removed, bytes reclaimed)."""
+        removed = 0
+        reclaimed = 0
+        for folder in (self.objects, self.mods):
+            if not os.path.isdir(folder):
+                continue
+            for dirpath, dirnames, filenames in os.walk(folder):
+                for name in dirnames:
+                    if name.endswith(".h2mmtmp"):
+                        shutil.rmtree(os.path.join(dirpath, name))
+                        removed += 1
+                dirnames[:] = [name for name in dirnames if not name.endswith(".h2mmtmp")]
+                if folder != self.objects:
+                    continue
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    st = os.stat(path)
+                    # the object itself is the only link left
+                    if st.st_nlink <= 1 or name.endswith(".h2mmtmp"):
+                        os.remove(path)
+                        removed += 1
+                        reclaimed += st.st_size
+        return removed, reclaimed
@@ -1,31 +1,136 @@
-from functools import cache
+import contextlib
 from hashlib import sha256
 import json
+import logging
 import os
+import time
 import typing
-import zipfile
-import rarfile
-from h2mm.etc import CacheOnModifiedDate
-from h2mm.model import H2PathRef
-
+from h2mm.archives import (
+    BACKENDS,
+    ArchiveBackend,
+    archive_errors,
+    archive_exts,
+    archive_kind,
+    describe_archive_error,
+    open_archive,
+    spool,
+)
+from h2mm.etc import FingerprintCache, stat_identity
+from h2mm.hashing import chunk_size, hash_file, iter_chunks, set_chunk_size
+from h2mm.model import H2PathRef, H2WalkStats
+from h2mm.perf import profiler
+
+# size of the head, middle and tail windows of each part hashed into a sample digest
+SAMPLE_WINDOW = 64 * 1024
+SAMPLE_ID_PREFIX = "sample:"
+
+# an archive inside an archive is addressed as <member>!/<folder> in subpaths,
+# and archives are only looked into this many levels deep
+NESTED_SEP = "!/"
+NESTED_MAX_DEPTH = 2
+
+# glob patterns of the files and folders a resource folder wants left out of scans
+IGNORE_FILE = ".h2mmignore"
+
+# persistent fingerprint store, bound to a file next to config.toml by H2MM
+fingerprint_cache = FingerprintCache()
+
+
+def _triple_identity(path: str, name: str):
+    identity = [
+        stat_identity(os.path.join(path, name + suffix))
+        for suffix in ("", ".gpu_resources", ".stream")
+    ]
+    return identity if identity[0] is not None else None
 
-def calculate_hash(path: str, name: str):
-    hash = sha256()
-    with open(os.path.join(path, name), "rb") as f:
-        while chunk := f.read(8192):
-            hash.update(chunk)
 
-    if os.path.exists(os.path.join(path, name + ".gpu_resources")):
-        with open(os.path.join(path, name + ".gpu_resources"), "rb") as f:
-            while chunk := f.read(8192):
-                hash.update(chunk)
+def _archive_identity(path: str, folder: str = ""):
+    return stat_identity(path)
 
-    if os.path.exists(os.path.join(path, name + ".stream")):
-        with open(os.path.join(path, name + ".stream"), "rb") as f:
-            while chunk := f.read(8192):
-                hash.update(chunk)
 
-    return hash.hexdigest()
+def _folder_identity(path: str):
+    identity = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+                identity.append([entry.name, st.st_size, st.st_mtime_ns, entry.inode()])
+    except OSError:
+        return None
+    identity.sort()
+    return identity
+
+
+@fingerprint_cache(_triple_identity)
+def calculate_hash(path: str, name: str):
+    with profiler.span("hash.file"):
+        hash = sha256()
+        hash_file(hash, os.path.join(path, name))
+        for suffix in (".gpu_resources", ".stream"):
+            if os.path.exists(os.path.join(path, name + suffix)):
+                hash_file(hash, os.path.join(path, name + suffix))
+        return hash.hexdigest()
+
+
+def _sample_windows(size: int):
+    if size <= 3 * SAMPLE_WINDOW:
+        return [(0, size)]
+    mid = (size - SAMPLE_WINDOW) // 2
+    return [(0, SAMPLE_WINDOW), (mid, mid + SAMPLE_WINDOW), (size - SAMPLE_WINDOW, size)]
+
+
+def _feed_part(f: typing.IO[bytes], hasher, sampler, size: int, kind: str):
+    """Stream a part into its full hash and its sample digest at the same time."""
+    windows = _sample_windows(size)
+    offset = 0
+    for chunk in iter_chunks(f, size, kind):
+        hasher.update(chunk)
+        end = offset + len(chunk)
+        for start, stop in windows:
+            if start < end and stop > offset:
+                sampler.update(chunk[max(start - offset, 0) : min(stop, end) - offset])
+        offset = end
+
+
+def triple_sizes(path: str, name: str) -> typing.Tuple[int, ...]:
+    """Sizes of the parts of a patch triple that exist on disk."""
+    sizes = []
+    for suffix in ("", ".gpu_resources", ".stream"):
+        identity = stat_identity(os.path.join(path, name + suffix))
+        if identity is not None:
+            sizes.append(identity[0])
+    return tuple(sizes)
+
+
+@fingerprint_cache(_triple_identity)
+def generate_triple_sample(path: str, name: str):
+    """Return [sizes, sample] of a patch triple on disk, where sample digests
+    only the head, middle and tail windows of each part."""
+    with profiler.span("hash.sample"):
+        sizes = []
+        sampler = sha256()
+        for suffix in ("", ".gpu_resources", ".stream"):
+            file = os.path.join(path, name + suffix)
+            if suffix and not os.path.exists(file):
+                continue
+            size = os.path.getsize(file)
+            sizes.append(size)
+            with open(file, "rb") as f:
+                for start, stop in _sample_windows(size):
+                    f.seek(start)
+                    sampler.update(f.read(stop - start))
+        return sizes, sampler.hexdigest()
+
+
+def sample_id(sizes: typing.Iterable[int], sample: str):
+    """An install key for a patch that does not match any library mod."""
+    return SAMPLE_ID_PREFIX + "-".join(str(size) for size in sizes) + ":" + sample
+
+
+def is_sample_id(hash: str):
+    return hash.startswith(SAMPLE_ID_PREFIX)
 
 
 def verify_and_get_target_file(filelist: list[str]):
@@ -40,54 +145,212 @@ def verify_and_get_target_file(filelist: list[str]):
 
     return target_files[0]
 
-def filter_filelist(filelist: list[str], folder: str):
-    if folder == "":
-        return filelist
-    folderDepth = len(os.path.normpath(folder).split(os.sep))
-    files = []
-    
+def plan_archive(filelist: typing.Iterable[str]):
+    """Group archive members by folder and pick the hashed parts of every eligible folder.
+    Returns {folder: ([target, gpu_resources?, stream?], manifest?)} in archive order."""
+    by_folder: dict[str, list[str]] = {}
     for file in filelist:
-        if file.startswith(folder) and not file.endswith("/") and len(file.split("/")) -1 == folderDepth:
-            files.append(file)
-    return files
+        folder, _, name = file.rpartition("/")
+        by_folder.setdefault(folder + "/" if folder else "", []).append(name)
+
+    plan = {}
+    for folder, names in by_folder.items():
+        try:
+            target = verify_and_get_target_file(names)
+        except ValueError:
+            continue
+        parts = [folder + target] + [
+            folder + target + suffix
+            for suffix in (".gpu_resources", ".stream")
+            if target + suffix in names
+        ]
+        manifest = folder + "manifest.json" if "manifest.json" in names else None
+        plan[folder] = (parts, manifest)
+    return plan
+
+
+def _spool_member(archive: ArchiveBackend, member: str):
+    """Copy an archive member into a seekable file."""
+    with archive.open(member) as f:
+        return spool(f)
+
+
+@contextlib.contextmanager
+def open_nested(path: str, subpath: str):
+    """Open the archive a subpath points into, following <member>!/ through nested archives.
+    Yields the innermost archive and the folder left of subpath inside it."""
+    with contextlib.ExitStack() as stack:
+        archive = stack.enter_context(open_archive(path))
+        while NESTED_SEP in subpath:
+            member, subpath = subpath.split(NESTED_SEP, 1)
+            spooled = stack.enter_context(_spool_member(archive, member))
+            archive = stack.enter_context(open_archive(member, spooled))
+        yield archive, subpath
+
+
+@fingerprint_cache(_archive_identity, version=2)
+def generate_archive_meta(path: str):
+    """Hash every eligible folder of an archive, opening it once and reading each member once.
+    Members are read in hash order where the backend can seek to them, and in one
+    sequential pass over a solid archive, where a part that comes before the part it
+    follows in the hash is spooled until its turn.
+    Archives inside it are spooled and hashed the same way, their folders
+    are listed as <member>!/<folder>.
+    Returns [[folder, hash, manifest, sizes, sample], ...]."""
+    with profiler.span("hash.archive"), open_archive(path) as archive:
+        return _archive_meta(archive, path)
+
+
+def _archive_meta(archive: ArchiveBackend, path: str, depth: int = 0):
+    infos = {member.filename: member for member in archive.members()}
+    plan = plan_archive(infos)
+    nested = set()
+    if depth < NESTED_MAX_DEPTH:
+        nested = {member for member in infos if member.endswith(archive_exts())}
+    nested_metas = []
+
+    roles = {}
+    for folder, (parts, manifest) in plan.items():
+        for index, part in enumerate(parts):
+            roles[part] = (folder, index)
+        if manifest:
+            roles[manifest] = (folder, None)
+
+    hashers = {folder: sha256() for folder in plan}
+    samplers = {folder: sha256() for folder in plan}
+    next_part = {folder: 0 for folder in plan}
+    spooled: dict[str, dict[int, typing.IO[bytes]]] = {folder: {} for folder in plan}
+    manifests = {}
+
+    if archive.solid:
+        order = [member for member in infos if member in roles or member in nested]
+    else:
+        order = [
+            member
+            for parts, manifest in plan.values()
+            for member in ([manifest] if manifest else []) + parts
+        ] + [member for member in infos if member in nested]
+
+    for member, f in archive.stream(order):
+        if member in nested:
+            nested_metas += _nested_meta(f, path, member, depth)
+            continue
+        folder, index = roles[member]
+        if index is None:
+            manifests[folder] = json.load(f)
+            continue
+        if index != next_part[folder]:
+            spooled[folder][index] = spool(f)
+            continue
+        size = infos[member].file_size
+        _feed_part(f, hashers[folder], samplers[folder], size, archive.kind)
+        next_part[folder] += 1
+        while next_part[folder] in spooled[folder]:
+            part = plan[folder][0][next_part[folder]]
+            with spooled[folder].pop(next_part[folder]) as spooled_part:
+                size = infos[part].file_size
+                _feed_part(spooled_part, hashers[folder], samplers[folder], size, "spool")
+            next_part[folder] += 1
+
+    return [
+        [
+            folder,
+            hashers[folder].hexdigest(),
+            manifests.get(folder),
+            [infos[part].file_size for part in plan[folder][0]],
+            samplers[folder].hexdigest(),
+        ]
+        for folder in plan
+    ] + nested_metas
+
+
+def _nested_meta(f: typing.IO[bytes], path: str, member: str, depth: int):
+    """_archive_meta of an archive member read from f, with its folders prefixed by <member>!/.
+    An unreadable nested archive is skipped with a warning instead of failing the outer one."""
+    try:
+        with spool(f) as spooled:
+            with open_archive(member, spooled) as inner:
+                metas = _archive_meta(inner, path + NESTED_SEP + member, depth + 1)
+    except archive_errors() as e:
+        logging.warning(describe_archive_error(e, path + NESTED_SEP + member))
+        return []
+    return [[member + NESTED_SEP + folder, *meta] for folder, *meta in metas]
 
 
-@cache
 def generate_zip_meta(zip_file: str, folder: str = ""):
-    with zipfile.ZipFile(zip_file, "r") as zip_ref:
-        filelist = zip_ref.namelist()
-        filteredList = filter_filelist(filelist, folder)
-        file = verify_and_get_target_file(filteredList)
-
-        filehash = sha256()
-        with zip_ref.open(file) as f:
-            while chunk := f.read(8192):
-                filehash.update(chunk)
-
-        if file + ".gpu_resources" in filelist:
-            with zip_ref.open(file + ".gpu_resources") as f:
-                while chunk := f.read(8192):
-                    filehash.update(chunk)
-
-        if file + ".stream" in filelist:
-            with zip_ref.open(file + ".stream") as f:
-                while chunk := f.read(8192):
-                    filehash.update(chunk)
-
-        if folder + "manifest.json" in filelist:
-            with zip_ref.open("manifest.json") as f:
+    for subpath, hvalue, manifest, _, _ in generate_archive_meta(zip_file):
+        if subpath == folder:
+            return hvalue, manifest
+    raise ValueError(f"Expected exactly one target file in {zip_file}:{folder}")
+
+
+# fast identities are built from the zip central directory and stand in for the sha256
+FAST_ID_PREFIX = "zipcrc:"
+
+
+@fingerprint_cache(_archive_identity)
+def generate_zip_fast_meta(zip_file: str):
+    """Fingerprint every eligible folder of a zip from the CRC32 and uncompressed size
+    the central directory stores for its parts, without decompressing them.
+    Folders whose parts have no stored CRC, such as those of a nested tar, get their sha256.
+    Returns [[folder, fast_id, manifest], ...]."""
+    with profiler.span("hash.zip_fast"), open_archive(zip_file) as zip_ref:
+        metas = _archive_fast_meta(zip_ref, zip_file)
+    if any(fast_id is None for _, fast_id, _ in metas):
+        full = {
+            folder: [folder, hvalue, manifest]
+            for folder, hvalue, manifest, *_ in generate_archive_meta(zip_file)
+        }
+        metas = [full[meta[0]] if meta[1] is None else meta for meta in metas]
+    return metas
+
+
+def _archive_fast_meta(archive: ArchiveBackend, path: str, depth: int = 0):
+    # nested archives are spooled to read their own directory, their parts are still not hashed
+    infos = {member.filename: member for member in archive.members()}
+    metas = []
+    for folder, (parts, manifest) in plan_archive(infos).items():
+        fast_id = None
+        if all(infos[part].crc is not None for part in parts):
+            fast_id = FAST_ID_PREFIX + "-".join(
+                f"{infos[part].file_size}.{infos[part].crc:08x}" for part in parts
+            )
+        if manifest:
+            with archive.open(manifest) as f:
                 manifest = json.load(f)
-        else:
-            manifest = None
+        metas.append([folder, fast_id, manifest])
+
+    for member in infos:
+        if not member.endswith(archive_exts()) or depth >= NESTED_MAX_DEPTH:
+            continue
+        nested = path + NESTED_SEP + member
+        try:
+            with _spool_member(archive, member) as spooled:
+                with open_archive(member, spooled) as inner:
+                    metas += [
+                        [member + NESTED_SEP + folder, *meta]
+                        for folder, *meta in _archive_fast_meta(inner, nested, depth + 1)
+                    ]
+        except archive_errors() as e:
+            logging.warning(describe_archive_error(e, nested))
+    return metas
 
-        return filehash.hexdigest(), manifest
+
+def is_fast_id(hash: str):
+    return hash.startswith(FAST_ID_PREFIX)
+
+
+def fast_id_sizes(hash: str) -> typing.Tuple[int, ...]:
+    return tuple(
+        int(part.split(".")[0]) for part in hash[len(FAST_ID_PREFIX) :].split("-")
+    )
 
 
 def calculate_zip_hash(zip_file: str, folder: str = ""):
     return generate_zip_meta(zip_file, folder)[0]
 
 
-@CacheOnModifiedDate()
+@fingerprint_cache(_folder_identity)
 def generate_folder_meta(path: str):
     filelist = os.listdir(path)
     filelist = [file for file in filelist if os.path.isfile(os.path.join(path, file))]
@@ -105,39 +368,23 @@ def calculate_folder_hash(path: str):
     return generate_folder_meta(path)[0]
 
 
-@cache
-def generate_rar_meta(path: str, folder: str = ""):
-    with rarfile.RarFile(path, "r") as rar_ref:
-        filelist = rar_ref.namelist()
-        filteredList = filter_filelist(filelist, folder)
-        file = verify_and_get_target_file(filteredList)
-
-        filehash = sha256()
-        with rar_ref.open(file) as f:
-            while chunk := f.read(8192):
-                filehash.update(chunk)
+@fingerprint_cache(_folder_identity)
+def generate_folder_sample(path: str):
+    filelist = [file for file in os.listdir(path) if os.path.isfile(os.path.join(path, file))]
+    return generate_triple_sample(path, verify_and_get_target_file(filelist))
 
-        if file + ".gpu_resources" in filelist:
-            with rar_ref.open(file + ".gpu_resources") as f:
-                while chunk := f.read(8192):
-                    filehash.update(chunk)
 
-        if file + ".stream" in filelist:
-            with rar_ref.open(file + ".stream") as f:
-                while chunk := f.read(8192):
-                    filehash.update(chunk)
-
-        if folder + "manifest.json" in filelist:
-            with rar_ref.open("manifest.json") as f:
-                manifest = json.load(f)
-        else:
-            manifest = None
-
-        return filehash.hexdigest(), manifest
-
-
-def calculate_rar_hash(path: str, folder: str = ""):
-    return generate_rar_meta(path, folder)[0]
+def get_part_sample(hash: str, pathref: H2PathRef):
+    """Return [sizes, sample] of an indexed mod; sample is None for fast identities."""
+    if is_fast_id(hash):
+        return [list(fast_id_sizes(hash)), None]
+    path = os.path.join(pathref.resourceGroup, pathref.path)
+    if os.path.isdir(path):
+        return list(generate_folder_sample(path))
+    for folder, _, _, sizes, sample in generate_archive_meta(path):
+        if folder == pathref.subpath:
+            return [sizes, sample]
+    raise ValueError(f"Expected exactly one target file in {path}:{pathref.subpath}")
 
 
 def smart_get_meta(path: str | typing.Tuple[str, ...], resourceGroup: str):
@@ -152,113 +399,304 @@ def smart_get_meta(path: str | typing.Tuple[str, ...], resourceGroup: str):
             ),
             manifest,
         )
-    elif (isinstance(path, tuple) and len(path) == 2 and path[0].endswith(".zip")):
+    elif isinstance(path, str):
+        path = (path, "")
+    if path[0].endswith(archive_exts()):
         hvalue, manifest = generate_zip_meta(path[0], path[1])
         return (
             hvalue,
             H2PathRef(path=os.path.relpath(path[0], resourceGroup), subpath=path[1], resourceGroup=resourceGroup),
             manifest,
         )
-    elif (isinstance(path, tuple) and len(path) == 2 and path[0].endswith(".rar")):
-        hvalue, manifest = generate_rar_meta(path[0], path[1])
-        return (
-            hvalue,
-            H2PathRef(path=os.path.relpath(path[0], resourceGroup), subpath=path[1], resourceGroup=resourceGroup),
-            manifest,
-        )
-    elif path.endswith(".zip"):
-        hvalue, manifest = generate_zip_meta(path)
-        return (
-            hvalue,
-            H2PathRef(path=os.path.relpath(path, resourceGroup), subpath="", resourceGroup=resourceGroup),
-            manifest,
-        )
-    elif path.endswith(".rar"):
-        hvalue, manifest = generate_rar_meta(path)
-        return (
-            hvalue,
-            H2PathRef(path=os.path.relpath(path, resourceGroup), subpath="", resourceGroup=resourceGroup),
-            manifest,
-        )
     else:
-        raise ValueError(f"Unsupported file type: {path}")
-
+        raise ValueError(f"Unsupported file type: {path[0]}")
+
+
+def _recursive_get_eligible_for_zip(
+    archive: ArchiveBackend,
+    name: typing.Optional[str] = None,
+    prefix: str = "",
+    depth: int = 0,
+):
+    if name is None:
+        name = archive.path
+    name = name.replace("\\", "/")
+    members = archive.namelist()
+    eligibles = [(name, prefix + folder) for folder in plan_archive(members)]
+
+    nested = []
+    if depth < NESTED_MAX_DEPTH:
+        nested = [member for member in members if member.endswith(archive_exts())]
+    for member, f in archive.stream(nested):
+        try:
+            with spool(f) as spooled:
+                with open_archive(member, spooled) as inner:
+                    eligibles += _recursive_get_eligible_for_zip(
+                        inner, name, prefix + member + NESTED_SEP, depth + 1
+                    )
+        except archive_errors() as e:
+            logging.warning(describe_archive_error(e, name + NESTED_SEP + prefix + member))
+    return eligibles
 
-def _recursive_get_eligible_for_zip(zip_file: zipfile.ZipFile | rarfile.RarFile):
-    eligibles = []
-    filelist = []
-    folders = [""]
-    for file in zip_file.namelist():
-        if os.path.isdir(file) or file.endswith("/"):
-            folders.append(file)
-        else:
-            filelist.append(file)
 
-    for folder in folders:
-        filteredFileList = [
-            os.path.basename(file)
-            for file in filelist
-            if os.path.dirname(file) == folder or os.path.dirname(file) + "/" == folder
-        ]
-        if not filteredFileList:
-            continue
+def load_ignore_rules(root: str) -> typing.List[str]:
+    """Glob patterns from the .h2mmignore of a resource folder, one per line.
+    Patterns with a / match the path relative to the resource folder, others the name,
+    and a trailing / only matches folders."""
+    try:
+        with open(os.path.join(root, IGNORE_FILE), "r", encoding="utf-8") as f:
+            lines = [line.strip() for line in f]
+    except OSError:
+        return []
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def _ignored(rules: typing.List[str], relpath: str, name: str, is_dir: bool):
+    import fnmatch
+
+    for rule in rules:
+        if rule.endswith("/"):
+            if not is_dir:
+                continue
+            rule = rule[:-1]
+        if fnmatch.fnmatchcase(relpath if "/" in rule else name, rule.lstrip("/")):
+            return True
+    return False
+
+
+def _scan_dir(path: str, mtime_ns: int, root: str, rules: typing.List[str]):
+    """List one folder with scandir, which knows the type of each entry without a stat.
+    Returns (folder unit, [(subfolder, mtime_ns)], [(relpath, archive unit)], stat calls)."""
+    relpath = os.path.relpath(path, root).replace("\\", "/")
+    prefix = "" if relpath == "." else relpath + "/"
+    archives = []
+    folders = []
+    files = []
+    stat_calls = 0
+    exts = archive_exts()
+    with os.scandir(path) as it:
+        for entry in it:
+            name = entry.name
+            if name == IGNORE_FILE:
+                continue
+            if name.endswith(exts):
+                if rules and _ignored(rules, prefix + name, name, False):
+                    continue
+                st = entry.stat()
+                stat_calls += 1
+                archives.append(
+                    (prefix + name, [archive_kind(name), [st.st_size, st.st_mtime_ns]])
+                )
+            elif entry.is_dir():
+                if name.startswith(".") or name.startswith("_"):
+                    continue
+                if rules and _ignored(rules, prefix + name, name, True):
+                    continue
+                st = entry.stat()
+                stat_calls += 1
+                folders.append((entry.path, st.st_mtime_ns))
+            else:
+                if rules and _ignored(rules, prefix + name, name, False):
+                    continue
+                st = entry.stat()
+                stat_calls += 1
+                files.append([name, st.st_size, st.st_mtime_ns])
+    unit = (relpath, ["folder", [mtime_ns, sorted(files)]])
+    return unit, folders, archives, stat_calls
+
+
+def walk_resource_units(
+    path: str,
+    root: typing.Optional[str] = None,
+    jobs: int = 1,
+    max_depth: int = 0,
+    stats: typing.Optional[H2WalkStats] = None,
+):
+    """Walk a resource folder into its scan units, keyed by path relative to root.
+    A unit is either a folder, identified by its mtime and the size/mtime of its loose files,
+    or an archive, identified by its own size/mtime. Units are yielded in scan order.
+    Each level of the tree is listed with jobs threads, down to max_depth levels below
+    path if it is not 0. Entries matching the .h2mmignore of root are left out,
+    and the folders, files and stat calls of the walk are added to stats."""
+    start = time.perf_counter()
+    if root is None:
+        root = path
+    if stats is None:
+        stats = H2WalkStats()
+    rules = load_ignore_rules(root)
+
+    listed = {}
+    level = [(path, os.stat(path).st_mtime_ns)]
+    stats.stat_calls += 1
+    depth = 0
+    executor = None
+    if jobs > 1:
+        from concurrent.futures import ThreadPoolExecutor
+
+        executor = ThreadPoolExecutor(max_workers=jobs)
+    with profiler.span("walk"):
         try:
-            target_file = verify_and_get_target_file(filteredFileList)
+            while level:
+                args = ([folder for folder, _ in level], [mtime for _, mtime in level])
+                args += ([root] * len(level), [rules] * len(level))
+                results = (executor.map if executor else map)(_scan_dir, *args)
+                next_level = []
+                for (folder, _), result in zip(level, results):
+                    listed[folder] = result
+                    (_, (_, (_, files))), folders, archives, stat_calls = result
+                    stats.folders += 1
+                    stats.files += len(files) + len(archives)
+                    stats.stat_calls += stat_calls
+                    profiler.count("files_stat", stat_calls)
+                    if not max_depth or depth < max_depth:
+                        next_level.extend(folders)
+                level = next_level
+                depth += 1
+        finally:
+            if executor is not None:
+                executor.shutdown()
+    stats.seconds += time.perf_counter() - start
+
+    def units(folder):
+        unit, folders, archives, _ = listed[folder]
+        yield unit
+        for subfolder, _ in folders:
+            if subfolder in listed:
+                yield from units(subfolder)
+        yield from archives
+
+    yield from units(path)
+
+
+def unit_size(unit: list, fast: bool = False) -> int:
+    """Bytes read to hash a unit from walk_resource_units.
+    With fast, a zip is identified from its central directory and counts for nothing."""
+    kind, identity = unit
+    if fast and kind == "zip":
+        return 0
+    if kind == "folder":
+        return sum(size for _, size, _ in identity[1])
+    return identity[0]
+
+
+def get_unit_pairs(root: str, relpath: str, unit: list) -> typing.List[typing.Tuple[str, ...]]:
+    kind, identity = unit
+    path = os.path.normpath(os.path.join(root, relpath))
+    if kind == "folder":
+        try:
+            verify_and_get_target_file([file[0] for file in identity[1]])
         except ValueError:
-            continue
-        if target_file:
-            if isinstance(zip_file, zipfile.ZipFile):
-                name = zip_file.fp.name
-            elif isinstance(zip_file, rarfile.RarFile):
-                name = zip_file.filename
-            eligibles.append((name.replace("\\", "/"), folder.replace("\\", "/")))
+            return []
+        return [(path.replace("\\", "/"),)]
+    elif kind in BACKENDS:
+        with open_archive(path) as archive:
+            return _recursive_get_eligible_for_zip(archive)
+    raise ValueError(f"Unsupported unit kind: {kind}")
+
 
+def get_all_eligible_pairs(path: str) -> typing.List[typing.Tuple[str, ...]]:
+    eligibles = []
+    for relpath, unit in walk_resource_units(path):
+        eligibles.extend(get_unit_pairs(path, relpath, unit))
     return eligibles
 
 
-def get_all_eligible_pairs(path: str) -> typing.List[str]:
-    eligibles = []
-    namelist = os.listdir(path)
-    compressed_files = [
-        file for file in namelist if file.endswith(".zip") or file.endswith(".rar")
-    ]
-    folders = [file for file in namelist if os.path.isdir(os.path.join(path, file))]
-    remaining = [
-        file
-        for file in namelist
-        if file not in compressed_files and file not in folders
+def index_archive(path: str, resourceGroup: str, fast: bool = False):
+    """Return the (hash, H2PathRef, manifest) triple of every eligible folder in an archive.
+    With fast, zips are identified by generate_zip_fast_meta instead of their sha256."""
+    relpath = os.path.relpath(path, resourceGroup)
+    if fast and path.endswith(".zip"):
+        metas = generate_zip_fast_meta(path)
+    else:
+        metas = generate_archive_meta(path)
+    return [
+        (
+            hvalue,
+            H2PathRef(path=relpath, subpath=folder, resourceGroup=resourceGroup),
+            manifest,
+        )
+        for folder, hvalue, manifest, *_ in metas
     ]
-    try:
-        target_file = verify_and_get_target_file(remaining)
-        if target_file:
-            eligibles.append((path.replace("\\", "/"),))
-    except ValueError:
-        pass
-
-    for folder in folders:
-        if folder.startswith(".") or folder.startswith("_"):
-            continue
-        eligibles.extend(get_all_eligible_pairs(os.path.join(path, folder)))
 
-    for compressed_file in compressed_files:
-        if compressed_file.endswith(".zip"):
-            with zipfile.ZipFile(os.path.join(path, compressed_file), "r") as zip_ref:
-                eligibles.extend(_recursive_get_eligible_for_zip(zip_ref))
-        elif compressed_file.endswith(".rar"):
-            with rarfile.RarFile(os.path.join(path, compressed_file), "r") as rar_ref:
-                eligibles.extend(_recursive_get_eligible_for_zip(rar_ref))
-
-    return eligibles
 
+def scan_unit(root: str, relpath: str, unit: list, fast: bool = False):
+    """Hash every eligible mod of a unit from walk_resource_units.
+    Unreadable archives are turned into a warning instead of raising.
+    Returns (metas, warning) where metas is a list of (hash, H2PathRef, manifest)."""
+    kind = unit[0]
+    path = os.path.normpath(os.path.join(root, relpath))
+    try:
+        if kind == "folder":
+            pairs = get_unit_pairs(root, relpath, unit)
+            return [smart_get_meta(pair, resourceGroup=root) for pair in pairs], None
+        return index_archive(path, root, fast), None
+    except archive_errors() as e:
+        return [], describe_archive_error(e, path)
+
+
+def _init_scan_worker(cache_path: typing.Optional[str], max_entries: int, chunk: int):
+    if cache_path is not None:
+        fingerprint_cache.bind(cache_path, max_entries)
+    set_chunk_size(chunk)
+
+
+def scan_unit_worker(root: str, relpath: str, unit: list, fast: bool):
+    """scan_unit in a scan_process_pool worker, also returns the fingerprints it computed
+    for the parent to merge into fingerprint_cache."""
+    metas, warning = scan_unit(root, relpath, unit, fast)
+    return metas, warning, fingerprint_cache.drain()
+
+
+def scan_process_pool(jobs: int):
+    """A pool of jobs hashing processes sharing the fingerprint cache and chunk size."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    return ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=_init_scan_worker,
+        initargs=(fingerprint_cache.path, fingerprint_cache.max_entries, chunk_size()),
+    )
+
+
+def scan_units(
+    root: str,
+    units: typing.List[typing.Tuple[str, list]],
+    jobs: int = 1,
+    fast: bool = False,
+):
+    """Yield (relpath, metas, warning) for each unit, in the order of units.
+    With jobs > 1 the units are hashed in a process pool and the fingerprints
+    computed by the workers are merged back into fingerprint_cache."""
+    if jobs <= 1 or len(units) <= 1:
+        for relpath, unit in units:
+            yield (relpath, *scan_unit(root, relpath, unit, fast))
+        return
+
+    jobs = min(jobs, len(units))
+    with scan_process_pool(jobs) as executor:
+        results = executor.map(
+            scan_unit_worker,
+            [root] * len(units),
+            [relpath for relpath, _ in units],
+            [unit for _, unit in units],
+            [fast] * len(units),
+            chunksize=max(1, len(units) // (jobs * 4)),
+        )
+        for (relpath, _), (metas, warning, entries) in zip(units, results):
+            fingerprint_cache.merge(entries)
+            yield relpath, metas, warning
 
-import wcwidth  # noqa
 
 def get_string_width(s):
     """Get the display width of a string, accounting for CJK characters"""
+    import wcwidth
+
     return sum(wcwidth.wcwidth(c) for c in s)
 
 def wrap_text(text, width):
     """Wrap text accounting for CJK character widths"""
+    import wcwidth
+
     text = str(text).strip()
     lines = []
     current_line = []
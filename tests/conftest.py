@@ -0,0 +1,53 @@
+import os
+import random
+import pytest
+from h2mm.mgr import H2MM
+from h2mm.model import H2MMCfg
+
+BASE = "9ba626afa44a3aa3"
+
+
+def mod_files(seed: int, target: str = BASE + ".patch_0", sizes=(1000, 2000, 3000)):
+    """The target, .gpu_resources and .stream of a mod, with content decided by seed."""
+    rnd = random.Random(seed)
+    return {
+        target + suffix: rnd.randbytes(size)
+        for suffix, size in zip(("", ".gpu_resources", ".stream"), sizes)
+    }
+
+
+def write_files(folder: str, files: dict):
+    os.makedirs(folder, exist_ok=True)
+    for name, data in files.items():
+        with open(os.path.join(folder, name), "wb") as f:
+            f.write(data if isinstance(data, bytes) else data.encode())
+
+
+def data_files(h2mm: H2MM):
+    """name -> content of every file in the game data folder."""
+    data = os.path.join(h2mm.cfg.game_path, "data")
+    files = {}
+    for name in sorted(os.listdir(data)):
+        with open(os.path.join(data, name), "rb") as f:
+            files[name] = f.read()
+    return files
+
+
+@pytest.fixture
+def library(tmp_path):
+    """An empty game data folder, an empty resource folder and a config for them."""
+    game = tmp_path / "game"
+    (game / "data").mkdir(parents=True)
+    (game / "data" / BASE).write_bytes(b"base archive")
+    (tmp_path / "res").mkdir()
+    (tmp_path / "cfg").mkdir()
+    cfg_path = str(tmp_path / "cfg" / "config.toml")
+    H2MMCfg.create(str(game), [], cfgPath=cfg_path)
+    return tmp_path
+
+
+@pytest.fixture
+def h2mm(library):
+    manager = H2MM.load(str(library / "cfg" / "config.toml"))
+    yield manager
+    manager.db.close()
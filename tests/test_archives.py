@@ -0,0 +1,35 @@
+import io
+import tarfile
+import zipfile
+from conftest import mod_files
+
+
+def tar_bytes(files: dict):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def test_fast_scan_hashes_folders_of_a_nested_tar(library, h2mm):
+    files = mod_files(1)
+    inner = {"mod/" + name: data for name, data in files.items()}
+    with zipfile.ZipFile(library / "res" / "outer.zip", "w") as z:
+        z.writestr("inner.tar", tar_bytes(inner))
+        for name, data in mod_files(2).items():
+            z.writestr("zipped/" + name, data)
+    (library / "res" / "loose").mkdir()
+    for name, data in files.items():
+        (library / "res" / "loose" / name).write_bytes(data)
+
+    h2mm.cfg.fast_identity = True
+    h2mm.add_resource_folder(str(library / "res"))
+
+    outer = h2mm.which(str(library / "res" / "outer.zip"))
+    found = {pathref.subpath: hash for hash, pathref in outer}
+    # tar members store no CRC, the nested tar's folder falls back to its sha256
+    assert found["inner.tar!/mod/"] == h2mm.which(str(library / "res" / "loose"))[0][0]
+    assert found["zipped/"].startswith("zipcrc:")
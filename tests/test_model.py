@@ -0,0 +1,17 @@
+from h2mm.model import H2Mod
+
+
+def test_manifest_fields_of_the_wrong_type_fall_back(caplog):
+    mod = H2Mod.from_manifest({
+        "Name": "Armor",
+        "patchNumPriority": "high",
+        "replaceBase": None,
+        "overwrites": "CM-09",
+        "ignorable-overwrites": [1],
+    })
+    assert mod == H2Mod("Armor", "", overwrites=("CM-09",))
+    assert len(caplog.records) == 3
+
+
+def test_manifest_that_is_not_an_object():
+    assert H2Mod.from_manifest(["CM-09"]) == H2Mod("", "")
@@ -0,0 +1,99 @@
+import os
+import zipfile
+import pytest
+from h2mm.mgr import H2MM
+from conftest import BASE, data_files, mod_files, write_files
+
+
+@pytest.fixture
+def mods(library, h2mm):
+    """Three library mods patching the base archive, name -> (hash, files).
+    Their names are not hex, find_mod would take them for hash prefixes."""
+    files = {name: mod_files(seed) for seed, name in enumerate(("one", "two", "three"))}
+    for name, mod in files.items():
+        write_files(str(library / "res" / name), mod)
+    h2mm.add_resource_folder(str(library / "res"))
+    return {name: (h2mm.find_mod(name), mod) for name, mod in files.items()}
+
+
+def installed_files(files: dict, as_file: str):
+    return {as_file + name[len(BASE + ".patch_0") :]: data for name, data in files.items()}
+
+
+@pytest.mark.parametrize("kind", ["folder", "zip"])
+def test_install_materializes_the_exact_files(library, h2mm, kind):
+    files = mod_files(1)
+    if kind == "folder":
+        write_files(str(library / "res" / "mod"), files)
+    else:
+        with zipfile.ZipFile(library / "res" / "mod.zip", "w") as z:
+            for name, data in files.items():
+                z.writestr("mod/" + name, data)
+    h2mm.add_resource_folder(str(library / "res"))
+
+    installed, _ = h2mm.install_mod("mod")
+
+    assert installed == BASE + ".patch_0"
+    assert data_files(h2mm) == {BASE: b"base archive", **installed_files(files, installed)}
+    assert h2mm.mod_install_index == {h2mm.find_mod("mod"): installed}
+
+
+def test_apply_and_rollback_restore_the_data_folder(h2mm, mods):
+    h2mm.install_mod("one")
+    h2mm.install_mod("two")
+    h2mm.save_profile("both")
+    before = data_files(h2mm)
+    hash, files = mods["three"]
+    h2mm.profiles.save("three", {hash: sorted(installed_files(files, BASE + ".patch_0"))})
+
+    assert h2mm.apply_profile("three") == 1
+    assert data_files(h2mm) == {
+        BASE: b"base archive", **installed_files(files, BASE + ".patch_0")
+    }
+    assert h2mm.mod_install_index == {hash: BASE + ".patch_0"}
+
+    assert h2mm.rollback_profile() == 2
+    assert data_files(h2mm) == before
+    assert h2mm.mod_install_index == {
+        mods["one"][0]: BASE + ".patch_0", mods["two"][0]: BASE + ".patch_1"
+    }
+
+    h2mm.apply_profile("three")
+    h2mm.apply_profile("both")
+    assert data_files(h2mm) == before
+
+
+def test_interrupted_apply_is_rolled_back(library, h2mm, mods, monkeypatch):
+    h2mm.install_mod("one")
+    h2mm.install_mod("two")
+    before = data_files(h2mm)
+    installs = dict(h2mm.mod_install_index)
+    hash, files = mods["three"]
+    h2mm.profiles.save("three", {hash: sorted(installed_files(files, BASE + ".patch_0"))})
+
+    data = os.path.join(h2mm.cfg.game_path, "data")
+    replace = os.replace
+
+    def killed_after_one(src, dst):
+        # the process dies after moving one staged file into the data folder
+        if os.path.dirname(os.path.abspath(dst)) == os.path.abspath(data):
+            if killed_after_one.moved:
+                raise SystemExit
+            killed_after_one.moved = True
+        replace(src, dst)
+
+    killed_after_one.moved = False
+    monkeypatch.setattr(os, "replace", killed_after_one)
+    # nothing runs on the way out of a killed process, the journal is all that is left
+    monkeypatch.setattr(type(h2mm.profiles), "recover", lambda self: None)
+    with pytest.raises(SystemExit):
+        h2mm.apply_profile("three")
+    monkeypatch.undo()
+    assert data_files(h2mm) != before
+
+    manager = H2MM.load(h2mm.cfg_path)
+    try:
+        assert manager.mod_install_index == installs
+        assert data_files(manager) == before
+    finally:
+        manager.db.close()
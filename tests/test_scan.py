@@ -0,0 +1,67 @@
+import zipfile
+from h2mm import mgr
+from h2mm.mgr import H2MM
+from conftest import mod_files, write_files
+
+
+def test_interrupted_first_scan_is_resumed(library, h2mm, monkeypatch):
+    for seed in range(4):
+        write_files(str(library / "res" / f"mod{seed}"), mod_files(seed))
+    scan_units = mgr.scan_units
+
+    def interrupted(*args):
+        results = scan_units(*args)
+        yield next(results)
+        yield next(results)
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(mgr, "SCAN_CHECKPOINT_UNITS", 1)
+    monkeypatch.setattr(mgr, "scan_units", interrupted)
+    try:
+        h2mm.add_resource_folder(str(library / "res"))
+    except KeyboardInterrupt:
+        pass
+    monkeypatch.undo()
+
+    manager = H2MM.load(str(library / "cfg" / "config.toml"))
+    try:
+        assert len(manager.mod_res_index) == 4
+        assert manager.cfg.resources[0]["last_modified"] > 0
+    finally:
+        manager.db.close()
+
+
+def test_conflicting_manifest_is_an_error_of_its_unit(library, h2mm):
+    files = mod_files(1)
+    write_files(str(library / "res" / "a"), {**files, "manifest.json": '{"name": "A"}'})
+    write_files(str(library / "res" / "b"), {**files, "manifest.json": '{"name": "B"}'})
+    write_files(str(library / "res" / "c"), files)
+    h2mm.mod_res_index
+    h2mm.cfg.resources.append({"path": str(library / "res"), "last_modified": 0})
+
+    events = list(h2mm.scan_resource_folder(str(library / "res")))
+
+    [error] = [event for event in events if event.kind == "error"]
+    kept = ({"a", "b"} - {error.relpath}).pop()
+    [(hash, pathrefs)] = h2mm.mod_res_index.items()
+    assert h2mm.manifest_index[hash].name == kept.upper()
+    assert sorted(pathref.path for pathref in pathrefs) == sorted([kept, "c"])
+    assert error.relpath not in h2mm.tree_index[str(library / "res")]
+
+
+def test_every_unit_ends_with_a_scanned_event(library, h2mm):
+    write_files(str(library / "res" / "loose"), mod_files(1))
+    write_files(str(library / "res" / "empty"), {"readme.txt": "no mod here"})
+    with zipfile.ZipFile(library / "res" / "zipped.zip", "w") as z:
+        for name, data in mod_files(2).items():
+            z.writestr(name, data)
+    h2mm.mod_res_index
+    h2mm.cfg.resources.append({"path": str(library / "res"), "last_modified": 0})
+
+    events = list(h2mm.scan_resource_folder(str(library / "res"), fast=True))
+
+    discovered = [event.relpath for event in events if event.kind == "discovered"]
+    scanned = [event for event in events if event.kind == "scanned"]
+    assert sorted(event.relpath for event in scanned) == sorted(discovered)
+    # the zip is identified from its central directory, only the folders are read
+    assert scanned[-1].bytes_done == scanned[-1].bytes_total == 6000 + len("no mod here")
@@ -0,0 +1,13 @@
+import pytest
+from h2mm.snapshot import write_snapshot
+
+
+@pytest.mark.parametrize("relgroup", ["../elsewhere", "res/../../elsewhere", "/elsewhere"])
+def test_import_rejects_folders_outside_root(library, h2mm, relgroup):
+    (library / "elsewhere").mkdir()
+    snapshot = str(library / "index.snap")
+    write_snapshot(snapshot, {relgroup: {"units": {}, "refs": []}}, {}, {})
+
+    with pytest.raises(RuntimeError, match="outside"):
+        h2mm.import_index(snapshot, str(library / "res"))
+    assert h2mm.cfg.resources == []
@@ -0,0 +1,16 @@
+from conftest import BASE, data_files, mod_files, write_files
+
+
+def test_stored_mod_without_manifest_goes_by_its_source_name(library, h2mm):
+    files = mod_files(1)
+    write_files(str(library / "incoming" / "cool_mod"), files)
+
+    [hash] = h2mm.add_resource(str(library / "incoming" / "cool_mod"))
+
+    assert h2mm.find_mod("cool_mod") == hash
+    installed, _ = h2mm.install_mod("cool_mod")
+    assert installed == BASE + ".patch_0"
+    assert data_files(h2mm)[installed] == files[BASE + ".patch_0"]
+    assert h2mm.list_installed_mods()[0]["name"] == "cool_mod"
+    assert h2mm.remove_resource("cool_mod") == hash
+    assert hash not in h2mm.store